@@ -4,8 +4,8 @@ import os
 import sys
 import traceback
 import logging
+import threading
 from http.server import BaseHTTPRequestHandler
-import nest_asyncio
 
 # Configure logging to stdout immediately
 root = logging.getLogger()
@@ -16,81 +16,86 @@ root.addHandler(handler_log)
 
 logger = logging.getLogger(__name__)
 
-# Apply nest_asyncio
-nest_asyncio.apply()
-
 # Ensure the project root is in the path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# Global variables for caching
-BOT_INSTANCE = None
-DISPATCHER_INSTANCE = None
+# One event loop for the lifetime of the instance, running in its own thread.
+# Request threads hand coroutines to it, so concurrent requests are handled
+# concurrently and the Bot's aiohttp session stays bound to a single loop.
 LOOP = None
+_loop_lock = threading.Lock()
 
-def get_bot_and_dispatcher():
-    """Lazy initialization of Bot and Dispatcher."""
-    global BOT_INSTANCE, DISPATCHER_INSTANCE
-    if BOT_INSTANCE is None:
-        from aiogram import Bot, Dispatcher
-        from bot_core.config import BOT_TOKEN
-        from bot_core.handlers import router
-
-        if not BOT_TOKEN:
-            logger.error("BOT_TOKEN is not configured.")
-            raise ValueError("BOT_TOKEN is not configured.")
-
-        logger.info("Initializing Bot and Dispatcher...")
-        BOT_INSTANCE = Bot(token=BOT_TOKEN)
-        DISPATCHER_INSTANCE = Dispatcher()
-        DISPATCHER_INSTANCE.include_router(router)
-        logger.info("Bot and Dispatcher initialized successfully.")
-    return BOT_INSTANCE, DISPATCHER_INSTANCE
-
-def get_loop():
+def get_loop() -> asyncio.AbstractEventLoop:
     global LOOP
-    if LOOP is None:
-        try:
-            LOOP = asyncio.get_running_loop()
-            logger.info("Attached to existing loop.")
-        except RuntimeError:
+    with _loop_lock:
+        if LOOP is None:
             LOOP = asyncio.new_event_loop()
-            asyncio.set_event_loop(LOOP)
-            logger.info("Created new loop.")
+            threading.Thread(target=LOOP.run_forever, name="bot-loop", daemon=True).start()
+            logger.info("Started event loop thread.")
     return LOOP
 
+def run_on_loop(coro):
+    """Runs a coroutine on the shared loop and blocks the calling request thread for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+async def _prewarm():
+    from bot_core.runtime import get_bot_and_dispatcher
+    from bot_core.services.bot_info import load_bot_info
+    bot, _ = get_bot_and_dispatcher()
+    await load_bot_info(bot)
+
+from bot_core import update_filter
+from bot_core.config import WEBHOOK_PREWARM
+if WEBHOOK_PREWARM:
+    # The first update queues behind this on the loop instead of paying for
+    # the aiogram import and router setup after it has arrived.
+    asyncio.run_coroutine_threadsafe(_prewarm(), get_loop())
+
+async def handle_update(update_data):
+    from bot_core.runtime import process_update
+    from bot_core.services.storage import storage
+    from bot_core.utils.ffmpeg_registry import start_ffmpeg_discovery
+
+    storage.start_write_behind()
+    start_ffmpeg_discovery()
+    try:
+        await process_update(update_data)
+    finally:
+        # The instance may be frozen right after we respond, so
+        # coalesced writes must not outlive the request.
+        await storage.flush_async()
+
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         """Handles incoming POST requests from Telegram."""
-        loop = get_loop()
-
-        async def process_update():
-            try:
-                bot, dp = get_bot_and_dispatcher()
-
-                content_length = int(self.headers['Content-Length'])
-                body = self.rfile.read(content_length)
-                update_data = json.loads(body.decode('utf-8'))
-
-                logger.info(f"Update received: {update_data.get('update_id')}")
-
-                from aiogram.types import Update
-                update = Update.model_validate(update_data, context={"bot": bot})
+        try:
+            content_length = int(self.headers['Content-Length'])
+            body = self.rfile.read(content_length)
+            update_data = update_filter.loads(body)
 
-                await dp.feed_update(bot=bot, update=update)
-                logger.info(f"Update {update.update_id} processed.")
+            logger.info(f"Update received: {update_data.get('update_id')}")
 
+            # Nothing would handle it: ack without building the pydantic Update.
+            if not update_filter.is_relevant(update_data):
                 self.send_response(200)
                 self.end_headers()
                 self.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'))
+                return
 
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                logger.error(traceback.format_exc())
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+            # Answered only once handled: Vercel may freeze the instance as soon
+            # as the response is sent, so background work would never finish.
+            run_on_loop(handle_update(update_data))
 
-        loop.run_until_complete(process_update())
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'))
+
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            logger.error(traceback.format_exc())
+            self.send_response(500)
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
 
     def do_GET(self):
         """Health and Diagnostic check."""
@@ -98,18 +103,11 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Content-type', 'application/json')
         self.end_headers()
 
-        # Diagnostics
-        from bot_core.utils.video_processing import get_ffmpeg_path
-        loop = get_loop()
-        ffmpeg_path = loop.run_until_complete(get_ffmpeg_path())
-
-        diag = {
-            'status': 'ok',
-            'bot_initialized': BOT_INSTANCE is not None,
-            'ffmpeg_path': ffmpeg_path,
-            'ffmpeg_exists': os.path.exists(ffmpeg_path) if ffmpeg_path else False,
+        from bot_core.runtime import health_report
+        diag = health_report()
+        diag.update({
             'cwd': os.getcwd(),
             'ls_bin': os.listdir('bin') if os.path.exists('bin') else 'bin_not_found',
             'env': {k: v for k, v in os.environ.items() if 'TOKEN' not in k and 'ID' not in k}
-        }
+        })
         self.wfile.write(json.dumps(diag).encode('utf-8'))
@@ -0,0 +1,90 @@
+"""
+Standalone webhook server: one long-lived event loop, updates acked as
+soon as they are queued and handled concurrently in the background.
+
+    python -m api.server
+
+Listens on WEBHOOK_HOST:PORT at WEBHOOK_PATH, with GET /health for
+diagnostics. When WEBHOOK_URL is set the webhook is registered on startup.
+"""
+import logging
+import os
+import sys
+
+from aiohttp import web
+
+# Ensure the project root is in the path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot_core import update_filter
+from bot_core.config import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET
+from bot_core.runtime import UpdateQueue, get_bot_and_dispatcher, close_bot, health_report
+from bot_core.services.bot_info import load_bot_info
+from bot_core.services.storage import storage
+from bot_core.utils.ffmpeg_registry import start_ffmpeg_discovery
+from bot_core.utils.render_service import start_render_service, shutdown_render_service
+
+logger = logging.getLogger(__name__)
+
+# Seconds given to in-flight updates on shutdown.
+DRAIN_TIMEOUT = 30
+
+
+async def handle_update(request: web.Request) -> web.Response:
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=401)
+    try:
+        update_data = update_filter.loads(await request.read())
+    except ValueError:
+        return web.Response(status=400)
+
+    if not update_filter.is_relevant(update_data):
+        return web.json_response({'status': 'ok'})
+    if not request.app["updates"].submit(update_data):
+        # Telegram redelivers on any non-2xx answer.
+        return web.Response(status=503)
+    return web.json_response({'status': 'ok'})
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    report = health_report()
+    report['webhook'] = request.app["updates"].stats
+    return web.json_response(report)
+
+
+async def on_startup(app: web.Application):
+    # Before anything else starts threads: the process render pool forks.
+    start_render_service()
+    storage.start_write_behind()
+    start_ffmpeg_discovery()
+    app["updates"] = UpdateQueue()
+
+    bot, dp = get_bot_and_dispatcher()
+    await load_bot_info(bot)
+    if WEBHOOK_URL:
+        # Telegram stops sending update types no router handles at all.
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                              allowed_updates=dp.resolve_used_update_types())
+        logger.info(f"Webhook set to {WEBHOOK_URL}")
+
+
+async def on_cleanup(app: web.Application):
+    await app["updates"].drain(DRAIN_TIMEOUT)
+    await storage.stop_write_behind()
+    storage.close()
+    shutdown_render_service()
+    await close_bot()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", handle_health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT)
@@ -0,0 +1,116 @@
+"""
+Cold-start cost of the webhook entry point.
+
+    python benchmarks/bench_cold_start.py [runs]
+    python benchmarks/bench_cold_start.py --importtime [top]
+
+Default mode starts a fresh interpreter per run, in an empty working
+directory, and measures what a cold Vercel instance pays before it can
+answer /start: importing bot_core.runtime, building the Bot and
+Dispatcher, and handling one /start update up to its sendMessage call.
+The Bot talks to an in-process session that answers locally, so no
+network is involved.
+
+--importtime runs the same path under `python -X importtime` and lists
+the slowest modules by cumulative import time, plus which of the heavy
+optional modules (Pillow, bidi, arabic_reshaper, video_processing) were
+imported at all.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEAVY = ("PIL", "bidi", "arabic_reshaper", "bot_core.utils.image_processing", "bot_core.utils.video_processing")
+
+CHILD = r'''
+import time
+t0 = time.perf_counter()
+import asyncio, json, sys
+import bot_core.runtime as runtime
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Message
+t_import = time.perf_counter()
+
+class LocalSession(BaseSession):
+    """Answers API calls in-process; records when the first reply is sent."""
+    replied_at = None
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage) and self.replied_at is None:
+            LocalSession.replied_at = time.perf_counter()
+            return Message.model_validate({"message_id": 1, "date": 0, "chat": {"id": method.chat_id, "type": "private"}, "text": method.text})
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+bot, dp = runtime.get_bot_and_dispatcher()
+bot.session = LocalSession()
+t_setup = time.perf_counter()
+
+update = {"update_id": 1, "message": {"message_id": 1, "date": 0, "text": "/start",
+          "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+          "chat": {"id": 42, "type": "private"}, "from": {"id": 42, "is_bot": False, "first_name": "bench"}}}
+asyncio.run(runtime.process_update(update))
+heavy = [m for m in sys.modules if m.split(".")[0] in ("PIL", "bidi", "arabic_reshaper") or m.endswith(("image_processing", "video_processing"))]
+print(json.dumps({"import": t_import - t0, "setup": t_setup - t_import, "first_reply": LocalSession.replied_at - t0, "heavy_modules": sorted(heavy)}))
+'''
+
+
+def _env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT,
+        "BOT_TOKEN": "123456:bench",
+        # No membership lookup, so /start answers straight away.
+        "CHANNEL_USERNAME": "",
+        "STORAGE_WRITE_BEHIND": "False",
+    })
+    env.pop("VERCEL", None)
+    return env
+
+
+def run_once(extra_args=()) -> subprocess.CompletedProcess:
+    with tempfile.TemporaryDirectory() as workdir:
+        return subprocess.run([sys.executable, *extra_args, "-c", CHILD], cwd=workdir, env=_env(workdir),
+                              capture_output=True, text=True, check=True)
+
+
+def bench(runs: int):
+    results = [json.loads(run_once().stdout.strip().splitlines()[-1]) for _ in range(runs)]
+    for key in ("import", "setup", "first_reply"):
+        values = [r[key] * 1000 for r in results]
+        print(f"{key:<12} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+    print(f"heavy modules imported for /start: {results[-1]['heavy_modules'] or 'none'}")
+
+
+def importtime(top: int):
+    stderr = run_once(("-X", "importtime")).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|", 2))
+        rows.append((int(cumulative_us), int(self_us), name))
+    names = {name for _, _, name in rows}
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, own, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:14.1f} {own / 1000:9.1f}  {name}")
+    print()
+    for module in HEAVY:
+        print(f"{module:<36} {'imported' if module in names else 'not imported'}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--importtime":
+        importtime(int(sys.argv[2]) if len(sys.argv) > 2 else 25)
+    else:
+        bench(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
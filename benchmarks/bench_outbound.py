@@ -0,0 +1,100 @@
+"""
+Outbound limiter (bot_core/services/outbound.py) against a fake Bot API.
+
+    python benchmarks/bench_outbound.py [bulk_messages] [interactive_messages]
+
+Starts a local aiohttp server that answers Bot API calls and refuses every
+FLOOD_EVERY-th sendMessage with 429 / retry_after, points the bot at it via
+TELEGRAM_API_BASE, then sends a broadcast-sized burst at BULK priority
+while interactive replies trickle in. Reports how long each kind queued,
+how many 429s were retried, and whether any call failed.
+"""
+import asyncio
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+PORT = _free_port()
+FLOOD_EVERY = 50
+os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "100")
+
+from aiohttp import web  # noqa: E402
+from aiogram import Bot  # noqa: E402
+
+from bot_core.services.outbound import BULK, create_session, outbound_limiter, priority  # noqa: E402
+
+
+def fake_bot_api() -> web.Application:
+    calls = {"sendMessage": 0, "flooded": 0}
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        if method == "sendMessage":
+            calls["sendMessage"] += 1
+            if calls["sendMessage"] % FLOOD_EVERY == 0:
+                calls["flooded"] += 1
+                return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                          "parameters": {"retry_after": 1}}, status=429)
+            chat_id = int(data["chat_id"])
+            return web.json_response({"ok": True, "result": {
+                "message_id": calls["sendMessage"], "date": int(time.time()), "text": data.get("text", ""),
+                "chat": {"id": chat_id, "type": "private"}}})
+        return web.json_response({"ok": True, "result": True})
+
+    app = web.Application()
+    app["calls"] = calls
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def main(bulk: int, interactive: int):
+    app = fake_bot_api()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    bot = Bot(token="123456:bench", session=create_session())
+    failures = []
+
+    async def send(chat_id: int):
+        try:
+            await bot.send_message(chat_id, "bench")
+        except Exception as e:
+            failures.append(e)
+
+    async def broadcast():
+        priority.set(BULK)
+        await asyncio.gather(*(send(1000 + i) for i in range(bulk)))
+
+    async def replies():
+        for i in range(interactive):
+            await asyncio.sleep(0.05)
+            await send(42 + i % 5)
+
+    started = time.perf_counter()
+    await asyncio.gather(broadcast(), replies())
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    await runner.cleanup()
+
+    stats = outbound_limiter.stats()
+    print(f"global rate {outbound_limiter.global_rate:.0f}/s, {bulk} bulk + {interactive} interactive sends in {elapsed:.1f} s")
+    print(f"429s from fake API: {app['calls']['flooded']}, retried: {stats['retries']}, failed calls: {len(failures)}")
+    for name in ("interactive", "bulk"):
+        s = stats[name]
+        print(f"{name:<12} requests {s['requests']:5}   wait avg {s['wait_avg_ms']:8.1f} ms   max {s['wait_max_ms']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 300, int(sys.argv[2]) if len(sys.argv) > 2 else 20))
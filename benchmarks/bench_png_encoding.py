@@ -0,0 +1,90 @@
+"""
+Time/size tradeoff of the PNG encoding strategies used for stickers.
+
+    python benchmarks/bench_png_encoding.py [repeats]
+
+Renders a few representative 512x512 stickers (text only, solid
+background, photo backgrounds of varying detail) and encodes each one with:
+
+  legacy    optimize + level 9, then quantize + re-encode when over 64 KB
+  adaptive  encode_png(): predicted up front, one encode in the common case
+  fast      encode_png(fast=True), used for previews
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from bot_core.utils import image_processing as ip  # noqa: E402
+
+
+def _photo(blur: float) -> bytes:
+    channels = [Image.effect_noise((640, 480), 80).filter(ImageFilter.GaussianBlur(blur)) for _ in range(3)]
+    gradient = Image.linear_gradient("L").resize((640, 480))
+    photo = Image.merge("RGB", [Image.blend(c, gradient, 0.4) for c in channels])
+    buf = BytesIO()
+    photo.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _sticker(**overrides) -> Image.Image:
+    """Returns the RGBA image render_image would encode."""
+    captured = {}
+    original = ip.encode_png
+
+    def capture(img, fast=False):
+        captured["img"] = img.copy()
+        return b""
+
+    ip.encode_png = capture
+    try:
+        args = dict(text="سلام", v_pos="center", h_pos="center", font_key="Default", color_hex="#FFFFFF", size_key="medium")
+        args.update(overrides)
+        ip._render_image(**args)
+    finally:
+        ip.encode_png = original
+    return captured["img"]
+
+
+def legacy(img: Image.Image) -> bytes:
+    result = ip._save_png(img)
+    if len(result) > ip.PNG_SIZE_TARGET:
+        quantized = ip._save_png(ip._quantize(img))
+        if len(quantized) < len(result):
+            result = quantized
+    return result
+
+
+STRATEGIES = {
+    "legacy": legacy,
+    "adaptive": ip.encode_png,
+    "fast": lambda img: ip.encode_png(img, fast=True),
+}
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cases = {
+        "text/transparent": _sticker(),
+        "long text": _sticker(text="این یک متن طولانی برای تست است و باید کوچک شود"),
+        "text/default bg": _sticker(text="Hello", bg_mode="default"),
+        "photo/smooth": _sticker(text="Hi", bg_photo=_photo(6)),
+        "photo/detailed": _sticker(text="Hi", bg_photo=_photo(0)),
+    }
+    print(f"{'case':18} {'strategy':9} {'ms':>8} {'bytes':>8}  predicted")
+    for name, img in cases.items():
+        predicted = ip.predict_png_size(img)
+        for strategy, encode in STRATEGIES.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                data = encode(img)
+            ms = (time.perf_counter() - start) * 1000 / repeats
+            print(f"{name:18} {strategy:9} {ms:8.1f} {len(data):8d}  {predicted}")
+
+
+if __name__ == "__main__":
+    main()
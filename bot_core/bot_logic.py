@@ -1,13 +1,22 @@
 import logging
 import os
 import asyncio
-from typing import Optional, Dict, Any
-from .utils.video_processing import process_video_to_webm, get_ffmpeg_path
+from typing import Optional, Dict, Any, Awaitable, Callable, Union
+from .services.blob_store import BytesLike
+from .services.video_scheduler import video_scheduler, QueueFullError, VideoJobCancelled
 
 logger = logging.getLogger(__name__)
 
-async def run_ffmpeg(args: list) -> bool:
-    """Utility to run raw ffmpeg commands safely."""
+async def run_ffmpeg(args: list, uid: int = 0) -> bool:
+    """Utility to run raw ffmpeg commands safely, through the video job scheduler."""
+    try:
+        return await video_scheduler.submit(uid, lambda: _run_ffmpeg(args))
+    except (QueueFullError, VideoJobCancelled, asyncio.TimeoutError) as e:
+        logger.error(f"FFmpeg job not run: {type(e).__name__}")
+        return False
+
+async def _run_ffmpeg(args: list) -> bool:
+    from .utils.video_processing import get_ffmpeg_path, _communicate
     ffmpeg_path = await get_ffmpeg_path()
     if not ffmpeg_path:
         logger.error("FFmpeg path not found.")
@@ -20,7 +29,7 @@ async def run_ffmpeg(args: list) -> bool:
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await _communicate(process)
         if process.returncode == 0:
             return True
         else:
@@ -30,10 +39,25 @@ async def run_ffmpeg(args: list) -> bool:
         logger.error(f"Error running FFmpeg: {e}")
         return False
 
-async def convert_video_to_sticker(video_bytes: bytes, text_overlay: Optional[Dict[str, Any]] = None) -> Optional[bytes]:
-    """Converts Video bytes to Telegram-compatible WEBM sticker bytes."""
-    return await process_video_to_webm(video_bytes, text_overlay)
+OnQueued = Optional[Callable[[int], Awaitable[None]]]
+VideoInput = Union[BytesLike, str]
+
+async def _convert(uid: int, data: VideoInput, text_overlay: Optional[Dict[str, Any]], on_queued: OnQueued) -> Optional[bytes]:
+    # Imported here so text-only updates never load the video pipeline.
+    from .utils.video_processing import process_video_to_webm
+    try:
+        return await video_scheduler.submit(uid, lambda: process_video_to_webm(data, text_overlay), on_queued)
+    except asyncio.TimeoutError:
+        return None
+
+async def convert_video_to_sticker(video_bytes: VideoInput, text_overlay: Optional[Dict[str, Any]] = None, uid: int = 0, on_queued: OnQueued = None) -> Optional[bytes]:
+    """Converts Video bytes (or a path to the video file) to Telegram-compatible WEBM sticker bytes.
+
+    Raises QueueFullError when the scheduler is saturated and
+    VideoJobCancelled when the user's jobs were cancelled.
+    """
+    return await _convert(uid, video_bytes, text_overlay, on_queued)
 
-async def convert_gif_to_sticker(gif_bytes: bytes, text_overlay: Optional[Dict[str, Any]] = None) -> Optional[bytes]:
+async def convert_gif_to_sticker(gif_bytes: VideoInput, text_overlay: Optional[Dict[str, Any]] = None, uid: int = 0, on_queued: OnQueued = None) -> Optional[bytes]:
     """Converts GIF bytes to Telegram-compatible WEBM sticker bytes."""
-    return await process_video_to_webm(gif_bytes, text_overlay)
+    return await _convert(uid, gif_bytes, text_overlay, on_queued)
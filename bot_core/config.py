@@ -8,18 +8,130 @@ import os
 # This value MUST be set in the Vercel environment variables.
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-# This will be fetched automatically at runtime.
-BOT_USERNAME = ""
+# Fetched with getMe at startup (bot_core/services/bot_info.py) unless set here,
+# then refreshed every BOT_INFO_TTL seconds; it only changes via @BotFather.
+BOT_USERNAME = os.getenv("BOT_USERNAME", "")
+BOT_INFO_TTL = float(os.getenv("BOT_INFO_TTL", str(24 * 3600)))
+
+# Alternative Bot API server, e.g. a local telegram-bot-api or a fake one for
+# load tests (http://127.0.0.1:8081). Empty means api.telegram.org.
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "")
+
+# --- Outbound API Calls ---
+# Every Bot API call is paced: OUTBOUND_GLOBAL_RATE per second overall and,
+# for calls aimed at a chat, OUTBOUND_CHAT_RATE per second with bursts of
+# OUTBOUND_CHAT_BURST. Interactive replies are served before broadcasts.
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+# RetryAfter replies are waited out and the call repeated, up to
+# OUTBOUND_MAX_RETRIES times and only when the wait is at most OUTBOUND_MAX_RETRY_AFTER seconds.
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_MAX_RETRY_AFTER = float(os.getenv("OUTBOUND_MAX_RETRY_AFTER", "30"))
 
 # --- Channel, Support & Admin ---
 CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME", "@redoxbot_sticker")
 SUPPORT_USERNAME = os.getenv("SUPPORT_USERNAME", "@onedaytoalive")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "6053579919"))
 
+# --- Webhook Server ---
+# Standalone aiohttp server (python -m api.server). Updates are acked at once
+# and handled in background tasks, at most WEBHOOK_MAX_CONCURRENT at a time;
+# beyond WEBHOOK_MAX_PENDING waiting updates Telegram is asked to retry later.
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Public URL registered with setWebhook on startup, and the secret Telegram
+# echoes in X-Telegram-Bot-Api-Secret-Token. Both optional.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONCURRENT = int(os.getenv("WEBHOOK_MAX_CONCURRENT", "32"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+# Vercel: import aiogram and build the dispatcher in the background as soon as
+# the function module loads, rather than when the first update arrives.
+WEBHOOK_PREWARM = os.getenv("WEBHOOK_PREWARM", "True").lower() == "true"
+
+# Seconds a channel membership lookup is trusted: members for long, non-members
+# briefly so joining takes effect quickly. The check_membership button always re-checks.
+MEMBERSHIP_TTL_POSITIVE = float(os.getenv("MEMBERSHIP_TTL_POSITIVE", "600"))
+MEMBERSHIP_TTL_NEGATIVE = float(os.getenv("MEMBERSHIP_TTL_NEGATIVE", "20"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))
+
+# --- Broadcast ---
+# Telegram lets a bot send about 30 messages per second overall; broadcasts
+# stay below that with BROADCAST_CONCURRENCY senders sharing one token bucket.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+# Times one message is retried after a RetryAfter before it counts as failed.
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+# Seconds between progress edits to the admin, and deliveries between checkpoints.
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+BROADCAST_CHECKPOINT_EVERY = int(os.getenv("BROADCAST_CHECKPOINT_EVERY", "100"))
+
 # --- Bot Settings ---
 MAINTENANCE = os.getenv("MAINTENANCE", "False").lower() == "true"
 DAILY_LIMIT = int(os.getenv("DAILY_LIMIT", "5"))
 
+# --- Storage ---
+# "journal" appends per-user deltas and compacts in the background,
+# "sqlite" keeps one row per user (an existing JSON store is migrated once),
+# "json" rewrites the whole file on every change (legacy behaviour).
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "journal").lower()
+# Journal engine: journal lines written before a background compaction,
+# and whether every append is fsynced.
+STORAGE_COMPACT_EVERY = int(os.getenv("STORAGE_COMPACT_EVERY", "2000"))
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "False").lower() == "true"
+# Write-behind: mutations only mark keys dirty and a background task
+# flushes them every STORAGE_FLUSH_INTERVAL seconds or as soon as
+# STORAGE_FLUSH_THRESHOLD keys are pending.
+STORAGE_WRITE_BEHIND = os.getenv("STORAGE_WRITE_BEHIND", "True").lower() == "true"
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "1.0"))
+STORAGE_FLUSH_THRESHOLD = int(os.getenv("STORAGE_FLUSH_THRESHOLD", "200"))
+
+# --- Rendering ---
+# Memory budget (bytes) for finished renders kept by render_image.
+RENDER_CACHE_BYTES = int(os.getenv("RENDER_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Memory budget (bytes) for decoded photo backgrounds; a 512px layer is 1 MB.
+BACKGROUND_CACHE_BYTES = int(os.getenv("BACKGROUND_CACHE_BYTES", str(24 * 1024 * 1024)))
+# Edge length of the JPEG previews sent while the user is still editing.
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "256"))
+# Pillow work runs off the event loop. "process" scales with cores; "thread"
+# is the default on Vercel, where process pools are unavailable.
+RENDER_EXECUTOR = os.getenv("RENDER_EXECUTOR", "thread" if os.environ.get("VERCEL") or (os.cpu_count() or 1) < 2 else "process").lower()
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+# Renders allowed in flight at once; further callers wait for a slot.
+RENDER_MAX_PENDING = int(os.getenv("RENDER_MAX_PENDING", str(RENDER_WORKERS * 4)))
+
+# --- Video ---
+# Explicit ffmpeg binary; otherwise bin/ffmpeg and PATH are searched. What was
+# found (version, encoders, ffprobe) is cached in FFMPEG_CACHE_FILE.
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "")
+FFMPEG_CACHE_FILE = os.getenv("FFMPEG_CACHE_FILE", "/tmp/ffmpeg_caps.json" if os.getenv("VERCEL") else "ffmpeg_caps.json")
+# Parent directory for per-job conversion workspaces; /dev/shm is used when
+# this is unset, falling back to the system temp dir.
+VIDEO_WORKDIR = os.getenv("VIDEO_WORKDIR", "")
+# Largest upload accepted for conversion; the cloud Bot API refuses getFile above 20 MB.
+VIDEO_MAX_DOWNLOAD_BYTES = int(os.getenv("VIDEO_MAX_DOWNLOAD_BYTES", str(20 * 1024 * 1024)))
+# Rendered text overlays kept next to the workspaces for reuse across jobs.
+VIDEO_OVERLAY_CACHE_FILES = int(os.getenv("VIDEO_OVERLAY_CACHE_FILES", "256"))
+# ffmpeg jobs running at once (one libvpx-vp9 encoder per core), jobs allowed
+# to wait behind them, and seconds before a job's ffmpeg is killed.
+VIDEO_MAX_CONCURRENT = int(os.getenv("VIDEO_MAX_CONCURRENT", str(os.cpu_count() or 1)))
+VIDEO_MAX_QUEUED = int(os.getenv("VIDEO_MAX_QUEUED", "32"))
+VIDEO_JOB_TIMEOUT = float(os.getenv("VIDEO_JOB_TIMEOUT", "120"))
+# Two-pass VP9 encodes tried per conversion before giving up, and the libvpx
+# speed preset (-cpu-used, 0 = slowest/best ... 5 = fastest for "good").
+VIDEO_ENCODE_ATTEMPTS = int(os.getenv("VIDEO_ENCODE_ATTEMPTS", "3"))
+VIDEO_CPU_USED = int(os.getenv("VIDEO_CPU_USED", "4"))
+
+# --- Sticker Packs ---
+# Texts accepted in one message (one sticker per line) in batch mode, at
+# most the 120 stickers a static pack holds, and stickers uploaded in
+# parallel ahead of the in-order addStickerToSet calls for those that do
+# not fit in createNewStickerSet (50).
+PACK_BATCH_MAX = int(os.getenv("PACK_BATCH_MAX", "120"))
+PACK_UPLOAD_CONCURRENCY = int(os.getenv("PACK_UPLOAD_CONCURRENCY", "4"))
+
 # --- Word Filter ---
 # A space-separated string of forbidden words, read from env variables.
 FORBIDDEN_WORDS_STR = os.getenv("FORBIDDEN_WORDS", "kos kir kon koss kiri koon")
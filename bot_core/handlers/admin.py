@@ -2,6 +2,7 @@ from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery
 from ..config import ADMIN_ID
 from ..keyboards import admin_panel_kb, back_to_menu_kb
+from ..services import broadcast
 from ..services.storage import storage
 from .common import safe_edit_text
 
@@ -18,6 +19,22 @@ async def on_admin_broadcast_prompt(cb: CallbackQuery):
     await safe_edit_text(cb, "متن پیام همگانی را بفرستید:", reply_markup=back_to_menu_kb(True))
     await cb.answer()
 
+@router.callback_query(F.data == "admin:broadcast_resume")
+async def on_admin_broadcast_resume(cb: CallbackQuery, bot: Bot):
+    if cb.from_user.id != ADMIN_ID: return
+    if broadcast.resume_broadcast(bot, cb.from_user.id):
+        await cb.answer("ادامه ارسال از آخرین کاربر...")
+    else:
+        await cb.answer("پیام همگانی نیمه‌تمامی وجود ندارد.", show_alert=True)
+
+@router.callback_query(F.data == "admin:broadcast_stop")
+async def on_admin_broadcast_stop(cb: CallbackQuery):
+    if cb.from_user.id != ADMIN_ID: return
+    if broadcast.stop_broadcast():
+        await cb.answer("ارسال متوقف شد؛ بعداً از پنل ادمین ادامه دهید.")
+    else:
+        await cb.answer("پیام همگانی در حال ارسال نیست.", show_alert=True)
+
 @router.callback_query(F.data == "admin:dm_prompt")
 async def on_admin_dm_prompt(cb: CallbackQuery):
     if cb.from_user.id != ADMIN_ID: return
@@ -33,16 +50,9 @@ async def admin_message_handler(message: Message, bot: Bot):
 
     if step == "awaiting_broadcast":
         storage.update_session(message.from_user.id, {"admin": {}})
-        await message.answer("در حال ارسال پیام همگانی...")
-        users = storage.USERS.keys()
-        count = 0
-        for uid_str in users:
-            try:
-                await bot.send_message(int(uid_str), message.text)
-                count += 1
-            except Exception:
-                pass
-        await message.answer(f"پیام به {count} کاربر ارسال شد.", reply_markup=admin_panel_kb())
+        # Runs in the background; progress is posted to the admin as it goes.
+        if not broadcast.start_broadcast(bot, message.from_user.id, message.text):
+            await message.answer("یک پیام همگانی دیگر در حال ارسال است.", reply_markup=admin_panel_kb())
 
     elif step == "awaiting_dm_id":
         target_id = message.text.strip()
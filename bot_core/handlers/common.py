@@ -5,19 +5,22 @@ from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 from ..config import ADMIN_ID, CHANNEL_USERNAME, SUPPORT_USERNAME, DAILY_LIMIT
 from ..services.storage import storage
+from ..services.membership_cache import membership_cache
+from ..services.video_scheduler import video_scheduler
 from ..utils.helpers import _quota_left, _fmt_eta, _seconds_to_reset
 from ..keyboards import main_menu_kb, back_to_menu_kb, pack_selection_kb
 
 router = Router()
 
+async def _lookup_membership(bot: Bot, user_id: int) -> bool:
+    member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
+    return member.status in ["member", "administrator", "creator"]
+
 async def check_channel_membership(bot: Bot, user_id: int) -> bool:
     if not CHANNEL_USERNAME:
         return True
-    try:
-        member = await bot.get_chat_member(chat_id=CHANNEL_USERNAME, user_id=user_id)
-        return member.status in ["member", "administrator", "creator"]
-    except Exception:
-        return False
+    # Failed lookups count as "not a member", cached with the short negative TTL.
+    return await membership_cache.get(user_id, lambda: _lookup_membership(bot, user_id))
 
 async def require_channel_membership(message: Message, bot: Bot) -> bool:
     if await check_channel_membership(bot, message.from_user.id):
@@ -50,10 +53,14 @@ async def on_start(message: Message, bot: Bot):
     if not await require_channel_membership(message, bot):
         return
     storage.reset_session(message.from_user.id)
+    if storage.get_user(message.from_user.id).get("blocked"):
+        # Back after blocking the bot: include them in broadcasts again.
+        storage.update_user(message.from_user.id, {"blocked": False})
     await message.answer("سلام! خوش آمدید\nیکی از گزینه‌های زیر رو انتخاب کن:", reply_markup=main_menu_kb(message.from_user.id == ADMIN_ID))
 
 @router.callback_query(F.data == "check_membership")
 async def on_check_membership(cb: CallbackQuery, bot: Bot):
+    membership_cache.invalidate(cb.from_user.id)
     if await check_channel_membership(bot, cb.from_user.id):
         await cb.message.answer("عضویت شما تایید شد! حالا می‌توانید از ربات استفاده کنید.", reply_markup=main_menu_kb(cb.from_user.id == ADMIN_ID))
     else:
@@ -64,6 +71,7 @@ async def on_check_membership(cb: CallbackQuery, bot: Bot):
 async def on_home(cb: CallbackQuery, bot: Bot):
     if not await require_channel_membership(cb.message, bot):
         return
+    video_scheduler.cancel(cb.from_user.id)
     storage.reset_session(cb.from_user.id)
     await safe_edit_text(cb, "منوی اصلی:", reply_markup=main_menu_kb(cb.from_user.id == ADMIN_ID))
     await cb.answer()
@@ -154,6 +162,7 @@ A: تعداد پک‌ها محدودیت خاصی ندارد
 
     elif action == "admin" and is_admin:
         from ..keyboards import admin_panel_kb
-        await safe_edit_text(cb, "پنل ادمین:", reply_markup=admin_panel_kb())
+        from ..services import broadcast
+        await safe_edit_text(cb, "پنل ادمین:", reply_markup=admin_panel_kb(broadcast.can_resume(uid)))
 
     await cb.answer()
@@ -1,18 +1,24 @@
+import asyncio
 import logging
 import traceback
+from typing import Optional
 from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile, InputSticker
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 
-from ..config import ADMIN_ID, FORBIDDEN_WORDS, SUPPORT_USERNAME
+from ..config import ADMIN_ID, FORBIDDEN_WORDS, SUPPORT_USERNAME, VIDEO_MAX_DOWNLOAD_BYTES, PACK_BATCH_MAX
 from ..services.storage import storage
-from ..utils.image_processing import render_image
-from ..utils.video_processing import is_ffmpeg_installed
+from ..services.bot_info import get_bot_username
+from ..services.pack_builder import build_pack, input_sticker
+from ..services.blob_store import BlobRef, BlobTooLarge
+from ..utils.render_service import render_image_async, render_preview_async
+from ..utils.ffmpeg_registry import is_ffmpeg_installed
 from ..utils.helpers import _quota_left, is_valid_pack_name
 from ..bot_logic import convert_video_to_sticker, convert_gif_to_sticker
+from ..services.video_scheduler import QueueFullError, VideoJobCancelled
 from ..keyboards import (
-    simple_bg_kb, after_preview_kb, rate_kb, ai_type_kb,
+    simple_bg_kb, simple_text_kb, after_preview_kb, rate_kb, ai_type_kb,
     ai_image_source_kb, ai_vpos_kb, ai_hpos_kb, ai_color_kb, ai_size_kb,
     back_to_menu_kb, main_menu_kb
 )
@@ -21,6 +27,12 @@ from .common import require_channel_membership, safe_edit_text
 logger = logging.getLogger(__name__)
 router = Router()
 
+async def _download_to_blob(bot: Bot, file_id: str, max_size: Optional[int] = None) -> BlobRef:
+    """Streams a Telegram file chunk by chunk into the blob store; raises BlobTooLarge past max_size."""
+    with storage.blobs.writer(max_size) as writer:
+        await bot.download(file_id, destination=writer, seek=False)
+        return writer.commit()
+
 # --- Pack Handlers ---
 @router.callback_query(F.data.startswith("pack:"))
 async def on_pack_actions(cb: CallbackQuery, bot: Bot):
@@ -40,12 +52,13 @@ async def on_pack_actions(cb: CallbackQuery, bot: Bot):
             storage.update_session(uid, {
                 "current_pack_short_name": pack_short_name,
                 "current_pack_title": pack["name"],
+                "current_pack_pending": False,
                 "pack_wizard": {},
                 "mode": mode
             })
             if mode == "simple":
                 storage.update_session(uid, {"simple": {}})
-                await safe_edit_text(cb, f"پک «{pack['name']}» انتخاب شد. متن را بفرستید.")
+                await safe_edit_text(cb, f"پک «{pack['name']}» انتخاب شد. متن را بفرستید.", reply_markup=simple_text_kb())
             else:
                 storage.update_session(uid, {"ai": {}})
                 await safe_edit_text(cb, f"پک «{pack['name']}» انتخاب شد. نوع استیکر؟", reply_markup=ai_type_kb())
@@ -61,6 +74,14 @@ async def on_pack_actions(cb: CallbackQuery, bot: Bot):
         await safe_edit_text(cb, rules_text)
     await cb.answer()
 
+async def _show_sticker(cb: CallbackQuery, uid: int, data: bytes, sticker_format: str):
+    """Sends the finished sticker and keeps it, with Telegram's file_id for it, for rate:yes."""
+    storage.update_session(uid, {"last_sticker": data, "last_sticker_format": sticker_format, "last_sticker_file_id": None})
+    sent = await cb.message.answer_sticker(BufferedInputFile(data, "s.webm" if sticker_format == "video" else "s.webp"))
+    if sent.sticker:
+        storage.update_session(uid, {"last_sticker_file_id": sent.sticker.file_id})
+    await cb.message.answer("از این استیکر راضی بودی؟", reply_markup=rate_kb())
+
 # --- Simple Sticker Handlers ---
 @router.callback_query(F.data.startswith("simple:"))
 async def on_simple_actions(cb: CallbackQuery, bot: Bot):
@@ -79,17 +100,18 @@ async def on_simple_actions(cb: CallbackQuery, bot: Bot):
             await safe_edit_text(cb, "عکس پس‌زمینه را ارسال کنید.")
         else:
             storage.update_session(uid, {"simple": simple_data})
-            img = render_image(simple_data["text"], "center", "center", "Default", "#FFFFFF", "medium", bg_mode=bg_mode)
-            await cb.message.answer_photo(BufferedInputFile(img, "p.png"), caption="پیش‌نمایش:", reply_markup=after_preview_kb("simple"))
+            img = await render_preview_async(simple_data["text"], "center", "center", "Default", "#FFFFFF", "medium", bg_mode=bg_mode)
+            await cb.message.answer_photo(BufferedInputFile(img, "p.jpg"), caption="پیش‌نمایش:", reply_markup=after_preview_kb("simple"))
     elif action == "confirm":
-        img = render_image(simple_data["text"], "center", "center", "Default", "#FFFFFF", "medium",
-                          bg_mode=simple_data.get("bg_mode", "transparent"),
-                          bg_photo=simple_data.get("bg_photo_bytes"), as_webp=True)
-        storage.update_session(uid, {"last_sticker": img, "last_sticker_format": "static"})
-        await cb.message.answer_sticker(BufferedInputFile(img, "s.webp"))
-        await cb.message.answer("از این استیکر راضی بودی؟", reply_markup=rate_kb())
+        img = await render_image_async(simple_data["text"], "center", "center", "Default", "#FFFFFF", "medium",
+                                      bg_mode=simple_data.get("bg_mode", "transparent"),
+                                      bg_photo=storage.read_blob(simple_data.get("bg_photo_bytes")), as_webp=True)
+        await _show_sticker(cb, uid, img, "static")
     elif action == "edit":
         await safe_edit_text(cb, "پس‌زمینه رو انتخاب کن:", reply_markup=simple_bg_kb())
+    elif action == "batch":
+        storage.update_session(uid, {"simple": {"batch": True}})
+        await safe_edit_text(cb, f"متن‌ها را در یک پیام بفرستید، هر استیکر در یک خط (حداکثر {PACK_BATCH_MAX}).")
     await cb.answer()
 
 # --- AI Sticker Handlers ---
@@ -142,9 +164,9 @@ async def on_ai_actions(cb: CallbackQuery, bot: Bot):
             kb.button(text="بازگشت", callback_data="menu:home")
             await cb.message.answer("آیا می‌خواهید متنی روی ویدیو باشد یا بدون متن ادامه می‌دهید؟", reply_markup=kb.as_markup())
         else:
-            img = render_image(ai_data.get("text","Sample"), ai_data.get("v_pos", "center"), ai_data.get("h_pos", "center"),
-                              "Default", ai_data.get("color", "#FFFFFF"), ai_data.get("size", "medium"),
-                              bg_photo=ai_data.get("bg_photo_bytes"))
+            img = await render_preview_async(ai_data.get("text","Sample"), ai_data.get("v_pos", "center"), ai_data.get("h_pos", "center"),
+                                            "Default", ai_data.get("color", "#FFFFFF"), ai_data.get("size", "medium"),
+                                            bg_photo=storage.read_blob(ai_data.get("bg_photo_bytes")))
 
             caption = "پیش‌نمایش:"
             if ai_data.get("type") == "video":
@@ -153,7 +175,7 @@ async def on_ai_actions(cb: CallbackQuery, bot: Bot):
                     "صفحه سفید پشت برای نشون دادن فونت متن به شماست و بعد از زدن دکمه تایید روی گیف/ویدیو شما میاد"
                 )
 
-            await cb.message.answer_photo(BufferedInputFile(img, "p.png"), caption=caption, reply_markup=after_preview_kb("ai"))
+            await cb.message.answer_photo(BufferedInputFile(img, "p.jpg"), caption=caption, reply_markup=after_preview_kb("ai"))
     elif action == "confirm":
         if _quota_left(storage.get_user(uid), uid == ADMIN_ID) <= 0:
             await cb.answer("سهمیه تمام شد!", show_alert=True); return
@@ -161,7 +183,9 @@ async def on_ai_actions(cb: CallbackQuery, bot: Bot):
         sticker_type = ai_data.get("type", "video" if ai_data.get("video_bytes") else "image")
         if sticker_type == "video":
             await safe_edit_text(cb, "در حال پردازش ویدیو/گیف...")
-            video_bytes = ai_data.get("video_bytes")
+            # Blobs go to ffmpeg as a file path; only legacy inline bytes are passed in memory.
+            video_ref = ai_data.get("video_bytes")
+            video_bytes = storage.blob_path(video_ref) or storage.read_blob(video_ref)
             if video_bytes:
                 text_overlay = {k: ai_data.get(k) for k in ["text", "v_pos", "h_pos", "color", "size"]}
                 text_overlay["font_key"] = "Default"
@@ -171,24 +195,33 @@ async def on_ai_actions(cb: CallbackQuery, bot: Bot):
                 if not text_overlay.get("text"):
                     text_overlay = None
 
+                async def notify_queued(position: int):
+                    await cb.message.answer(f"درخواست شما در صف پردازش است (نفر {position}). لطفاً صبر کنید...")
+
                 # Use the new utility hub functions
-                webm_bytes = await convert_video_to_sticker(video_bytes, text_overlay)
+                # A new upload or /start can drop the session's ref while the job is queued.
+                storage.hold_blob(video_ref)
+                try:
+                    webm_bytes = await convert_video_to_sticker(video_bytes, text_overlay, uid=uid, on_queued=notify_queued)
+                except QueueFullError:
+                    await cb.message.answer("سرور در حال حاضر شلوغ است. چند دقیقه دیگر دوباره تلاش کنید.", reply_markup=back_to_menu_kb(uid == ADMIN_ID))
+                    await cb.answer(); return
+                except VideoJobCancelled:
+                    await cb.answer(); return
+                finally:
+                    storage.release_blob(video_ref)
                 if webm_bytes:
-                    storage.update_session(uid, {"last_sticker": webm_bytes, "last_sticker_format": "video"})
                     storage.get_user(uid)["ai_used"] += 1
-                    storage.save()
-                    await cb.message.answer_sticker(BufferedInputFile(webm_bytes, "s.webm"))
-                    await cb.message.answer("از این استیکر راضی بودی؟", reply_markup=rate_kb())
+                    storage.save(uid)
+                    await _show_sticker(cb, uid, webm_bytes, "video")
                 else:
-                    await cb.message.answer("خطا در پردازش ویدیو. مطمئن شوید زمان آن کمتر از ۳ ثانیه است.", reply_markup=back_to_menu_kb(uid == ADMIN_ID))
+                    await cb.message.answer("خطا در پردازش ویدیو. لطفاً دوباره تلاش کنید.", reply_markup=back_to_menu_kb(uid == ADMIN_ID))
         else:
-            img = render_image(ai_data["text"], ai_data["v_pos"], ai_data.get("h_pos", "center"), "Default", ai_data["color"], ai_data["size"],
-                              bg_photo=ai_data.get("bg_photo_bytes"), as_webp=True)
-            storage.update_session(uid, {"last_sticker": img, "last_sticker_format": "static"})
+            img = await render_image_async(ai_data["text"], ai_data["v_pos"], ai_data.get("h_pos", "center"), "Default", ai_data["color"], ai_data["size"],
+                                          bg_photo=storage.read_blob(ai_data.get("bg_photo_bytes")), as_webp=True)
             storage.get_user(uid)["ai_used"] += 1
-            storage.save()
-            await cb.message.answer_sticker(BufferedInputFile(img, "s.webp"))
-            await cb.message.answer("از این استیکر راضی بودی؟", reply_markup=rate_kb())
+            storage.save(uid)
+            await _show_sticker(cb, uid, img, "static")
     await cb.answer()
 
 # --- Sticker Rating and Final Addition ---
@@ -201,27 +234,29 @@ async def on_rate_actions(cb: CallbackQuery, bot: Bot):
 
     if action == "yes":
         sticker_bytes = s.get("last_sticker")
+        file_id = s.get("last_sticker_file_id")
         pack_name = s.get("current_pack_short_name")
         pack_title = s.get("current_pack_title")
 
-        if not all([sticker_bytes, pack_name, pack_title]):
+        if not all([sticker_bytes or file_id, pack_name, pack_title]):
             await safe_edit_text(cb, "خطا: اطلاعات پک یافت نشد.", reply_markup=back_to_menu_kb(uid == ADMIN_ID)); return
 
         await safe_edit_text(cb, "در حال افزودن به پک...")
         try:
             format = s.get("last_sticker_format", "static")
-            if format == "video":
-                sticker = InputSticker(sticker=BufferedInputFile(sticker_bytes, "s.webm"), format="video", emoji_list=["😀"])
-            else:
-                if s.get("mode") == "simple":
-                    d = s.get("simple", {})
-                    png = render_image(d.get("text"), "center", "center", "Default", "#FFFFFF", "medium", bg_mode=d.get("bg_mode"), bg_photo=d.get("bg_photo_bytes"), as_webp=False)
-                else:
-                    d = s.get("ai", {})
-                    png = render_image(d.get("text"), d.get("v_pos"), d.get("h_pos"), "Default", d.get("color"), d.get("size"), bg_photo=d.get("bg_photo_bytes"), as_webp=False)
-                sticker = InputSticker(sticker=BufferedInputFile(png, "s.png"), format="static", emoji_list=["😀"])
-
-            await bot.add_sticker_to_set(user_id=uid, name=pack_name, sticker=sticker)
+            # The preview already sent this file, so Telegram has it: no second upload.
+            added = False
+            if file_id:
+                try:
+                    await _put_in_pack(bot, uid, s, input_sticker(file_id, format))
+                    added = True
+                except TelegramBadRequest as e:
+                    if not sticker_bytes:
+                        raise
+                    logger.warning(f"Adding sticker by file_id failed, uploading it instead: {e}")
+            if not added:
+                # Static stickers accept WEBP as well, so the stored preview is uploaded as is.
+                await _put_in_pack(bot, uid, s, input_sticker(storage.read_blob(sticker_bytes), format))
 
             mode = s.get("mode", "simple")
             storage.reset_session(uid)
@@ -244,6 +279,40 @@ async def on_rate_actions(cb: CallbackQuery, bot: Bot):
         await safe_edit_text(cb, "چه چیزی رو دوست نداشتی؟")
     await cb.answer()
 
+async def _put_in_pack(bot: Bot, uid: int, s: dict, sticker: InputSticker):
+    """Adds a sticker to the current pack, creating the pack with it if it was only named so far."""
+    name, title = s["current_pack_short_name"], s["current_pack_title"]
+    if s.get("current_pack_pending"):
+        await bot.create_new_sticker_set(user_id=uid, name=name, title=title, stickers=[sticker])
+        storage.add_user_pack(uid, title, name)
+        storage.update_session(uid, {"current_pack_pending": False})
+    else:
+        await bot.add_sticker_to_set(user_id=uid, name=name, sticker=sticker)
+
+async def _add_batch(message: Message, bot: Bot, uid: int, s: dict, texts: list):
+    """Renders one sticker per text in parallel and puts them all in the current pack."""
+    name, title = s["current_pack_short_name"], s["current_pack_title"]
+    create = bool(s.get("current_pack_pending"))
+    await message.answer(f"در حال ساخت {len(texts)} استیکر...")
+    storage.update_session(uid, {"is_processing": True})
+    try:
+        images = await asyncio.gather(*(render_image_async(text, "center", "center", "Default", "#FFFFFF", "medium", as_webp=True)
+                                        for text in texts))
+        added, failed = await build_pack(bot, uid, name, title, images, create=create)
+    except Exception as e:
+        logger.error(f"Batch for {name} failed: {e}")
+        await message.answer(f"خطا در ساخت استیکرها: {e}", reply_markup=back_to_menu_kb(uid == ADMIN_ID))
+        return
+    finally:
+        storage.update_session(uid, {"is_processing": False})
+    if create:
+        storage.add_user_pack(uid, title, name)
+        storage.update_session(uid, {"current_pack_pending": False})
+    result = f"✅ {added} استیکر به پک «{title}» اضافه شد."
+    if failed:
+        result += f"\n{failed} استیکر اضافه نشد."
+    await message.answer(f"{result}\nhttps://t.me/addstickers/{name}", reply_markup=back_to_menu_kb(uid == ADMIN_ID))
+
 # --- Generic Message Handler ---
 @router.message()
 async def on_message(message: Message, bot: Bot):
@@ -254,26 +323,30 @@ async def on_message(message: Message, bot: Bot):
 
     if s.get("pack_wizard", {}).get("step") == "awaiting_name" and message.text:
         pack_name = message.text.strip().lower()
-        from ..utils.helpers import is_valid_pack_name
         if any(word in pack_name for word in FORBIDDEN_WORDS) or not is_valid_pack_name(pack_name):
             await message.answer("نام نامعتبر است."); return
 
-        bot_info = await bot.get_me()
-        short_name = f"{pack_name}_by_{bot_info.username}"
-        await message.answer("در حال ساخت پک...")
+        short_name = f"{pack_name}_by_{await get_bot_username(bot)}"
+        # Creation is deferred (see below), so a taken name is caught here
+        # rather than after the user has made the first stickers.
         try:
-            dummy = render_image("First", "center", "center", "Default", "#FFFFFF", "medium", as_webp=False)
-            sticker = InputSticker(sticker=BufferedInputFile(dummy, "s.png"), format="static", emoji_list=["🎉"])
-            await bot.create_new_sticker_set(uid, short_name, pack_name, stickers=[sticker], sticker_format='static')
-            storage.add_user_pack(uid, pack_name, short_name)
-            mode = s["pack_wizard"].get("mode", "simple")
-            storage.update_session(uid, {"current_pack_short_name": short_name, "current_pack_title": pack_name, "pack_wizard": {}, "mode": mode})
-            if mode == "simple":
-                await message.answer(f"پک ساخته شد! حالا متن استیکر را بفرستید.")
-            else:
-                await message.answer(f"پک ساخته شد! حالا نوع استیکر را انتخاب کنید:", reply_markup=ai_type_kb())
+            await bot.get_sticker_set(name=short_name)
+        except TelegramBadRequest:
+            pass  # STICKERSET_INVALID: the name is free
         except Exception as e:
-            await message.answer(f"خطا در ساخت پک: {e}")
+            logger.warning(f"Checking pack name {short_name} failed: {e}")
+            await message.answer("بررسی نام پک ممکن نشد. لطفاً دوباره نام را بفرستید."); return
+        else:
+            await message.answer("این نام قبلاً استفاده شده است. نام دیگری بفرستید."); return
+        # Telegram needs at least one sticker to create a pack, so it is
+        # created together with the first accepted sticker (or batch).
+        mode = s["pack_wizard"].get("mode", "simple")
+        storage.update_session(uid, {"current_pack_short_name": short_name, "current_pack_title": pack_name,
+                                     "current_pack_pending": True, "pack_wizard": {}, "mode": mode})
+        if mode == "simple":
+            await message.answer("نام پک ثبت شد! حالا متن استیکر را بفرستید.", reply_markup=simple_text_kb())
+        else:
+            await message.answer(f"نام پک ثبت شد! حالا نوع استیکر را انتخاب کنید:", reply_markup=ai_type_kb())
         return
 
     # Anti-spam/Single-media enforcement
@@ -289,20 +362,18 @@ async def on_message(message: Message, bot: Bot):
         if s.get("mode") == "simple" and s_simple.get("awaiting_bg_photo"):
             storage.update_session(uid, {"is_processing": True})
             try:
-                file = await bot.download(message.photo[-1].file_id)
-                s_simple["bg_photo_bytes"] = file.read()
+                s_simple["bg_photo_bytes"] = await _download_to_blob(bot, message.photo[-1].file_id)
                 s_simple["awaiting_bg_photo"] = False
                 storage.update_session(uid, {"simple": s_simple})
-                img = render_image(s_simple["text"], "center", "center", "Default", "#FFFFFF", "medium", bg_photo=s_simple["bg_photo_bytes"])
-                await message.answer_photo(BufferedInputFile(img, "p.png"), caption="پیش‌نمایش:", reply_markup=after_preview_kb("simple"))
+                img = await render_preview_async(s_simple["text"], "center", "center", "Default", "#FFFFFF", "medium", bg_photo=storage.read_blob(s_simple["bg_photo_bytes"]))
+                await message.answer_photo(BufferedInputFile(img, "p.jpg"), caption="پیش‌نمایش:", reply_markup=after_preview_kb("simple"))
             finally:
                 storage.update_session(uid, {"is_processing": False})
             return
         elif s.get("mode") == "ai_awaiting_source" and s_ai.get("awaiting_bg_photo"):
             storage.update_session(uid, {"is_processing": True})
             try:
-                file = await bot.download(message.photo[-1].file_id)
-                s_ai["bg_photo_bytes"] = file.read()
+                s_ai["bg_photo_bytes"] = await _download_to_blob(bot, message.photo[-1].file_id)
                 s_ai["awaiting_bg_photo"] = False
                 storage.update_session(uid, {"ai": s_ai, "mode": "ai_awaiting_text_for_image"})
                 await message.answer("عکس دریافت شد. حالا متن را بفرستید:")
@@ -322,14 +393,22 @@ async def on_message(message: Message, bot: Bot):
             await message.answer("ابتدا باید یک پک استیکر بسازید یا انتخاب کنید.", reply_markup=main_menu_kb(is_admin))
             return
 
+        too_large = f"حجم فایل بیشتر از حد مجاز است (حداکثر {VIDEO_MAX_DOWNLOAD_BYTES // (1024 * 1024)} مگابایت)."
+        if video.file_size and video.file_size > VIDEO_MAX_DOWNLOAD_BYTES:
+            await message.answer(too_large)
+            return
+
         storage.update_session(uid, {"is_processing": True})
         try:
             await message.answer("در حال دریافت فایل...")
-            file = await bot.download(video.file_id)
-            file_bytes = file.read()
+            try:
+                video_ref = await _download_to_blob(bot, video.file_id, VIDEO_MAX_DOWNLOAD_BYTES)
+            except BlobTooLarge:
+                await message.answer(too_large)
+                return
 
             ai_data = s.get("ai", {})
-            ai_data.update({"video_bytes": file_bytes, "type": "video"})
+            ai_data.update({"video_bytes": video_ref, "type": "video"})
             storage.update_session(uid, {"ai": ai_data, "mode": "ai_confirm_video_text"})
 
             kb = InlineKeyboardBuilder()
@@ -356,6 +435,18 @@ async def on_message(message: Message, bot: Bot):
         if s.get("current_pack_short_name"):
             mode = s.get("mode", "simple")
             if mode == "simple":
+                # Only the batch button turns lines into separate stickers; otherwise
+                # a multi-line text is one sticker.
+                if s.get("simple", {}).get("batch"):
+                    if s.get("is_processing"):
+                        await message.answer("لطفاً تا پایان ساخت استیکرهای قبلی صبر کنید."); return
+                    texts = [line.strip() for line in message.text.splitlines() if line.strip()]
+                    storage.update_session(uid, {"simple": {}})
+                    if len(texts) > PACK_BATCH_MAX:
+                        await message.answer(f"فقط {PACK_BATCH_MAX} خط اول ساخته می‌شود و {len(texts) - PACK_BATCH_MAX} خط نادیده گرفته شد.")
+                        texts = texts[:PACK_BATCH_MAX]
+                    await _add_batch(message, bot, uid, s, texts)
+                    return
                 storage.update_session(uid, {"simple": {"text": message.text.strip()}})
                 await message.answer("پس‌زمینه را انتخاب کنید:", reply_markup=simple_bg_kb())
             elif mode == "ai":
@@ -28,6 +28,11 @@ def simple_bg_kb():
     kb.adjust(3)
     return kb.as_markup()
 
+def simple_text_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="ساخت چند استیکر با هم", callback_data="simple:batch")
+    return kb.as_markup()
+
 def after_preview_kb(prefix: str):
     kb = InlineKeyboardBuilder()
     kb.button(text="تایید", callback_data=f"{prefix}:confirm")
@@ -100,10 +105,17 @@ def ai_size_kb():
     kb.adjust(3)
     return kb.as_markup()
 
-def admin_panel_kb():
+def admin_panel_kb(resumable: bool = False):
     kb = InlineKeyboardBuilder()
     kb.button(text="ارسال پیام همگانی", callback_data="admin:broadcast")
+    if resumable:
+        kb.button(text="ادامه پیام همگانی قبلی", callback_data="admin:broadcast_resume")
     kb.button(text="ارسال به کاربر خاص", callback_data="admin:dm_prompt")
     kb.button(text="تغییر سهمیه کاربر", callback_data="admin:quota_prompt")
     kb.adjust(1)
     return kb.as_markup()
+
+def broadcast_progress_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="توقف ارسال", callback_data="admin:broadcast_stop")
+    return kb.as_markup()
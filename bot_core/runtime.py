@@ -0,0 +1,137 @@
+"""
+Process-wide Bot, Dispatcher and update handling shared by the webhook
+entry points (api/index.py on Vercel, api/server.py standalone).
+
+There is a single Bot per process, hence a single aiohttp session for
+every outgoing API call.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .config import BOT_TOKEN, WEBHOOK_MAX_CONCURRENT, WEBHOOK_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+_bot = None
+_dispatcher = None
+
+
+def get_bot_and_dispatcher() -> Tuple[Any, Any]:
+    """Lazy initialization of Bot and Dispatcher."""
+    global _bot, _dispatcher
+    if _bot is None:
+        from aiogram import Bot, Dispatcher
+        from .handlers import router
+        from .services.outbound import create_session
+
+        if not BOT_TOKEN:
+            logger.error("BOT_TOKEN is not configured.")
+            raise ValueError("BOT_TOKEN is not configured.")
+
+        logger.info("Initializing Bot and Dispatcher...")
+        _bot = Bot(token=BOT_TOKEN, session=create_session())
+        _dispatcher = Dispatcher()
+        _dispatcher.include_router(router)
+        logger.info("Bot and Dispatcher initialized successfully.")
+    return _bot, _dispatcher
+
+
+def bot_initialized() -> bool:
+    return _bot is not None
+
+
+async def close_bot():
+    global _bot, _dispatcher
+    if _bot is not None:
+        await _bot.session.close()
+        _bot = _dispatcher = None
+
+
+async def process_update(update_data: Dict[str, Any]):
+    """Validates a raw update and runs it through the dispatcher."""
+    from aiogram.types import Update
+
+    bot, dp = get_bot_and_dispatcher()
+    update = Update.model_validate(update_data, context={"bot": bot})
+    await dp.feed_update(bot=bot, update=update)
+    logger.info(f"Update {update.update_id} processed.")
+
+
+class UpdateQueue:
+    """
+    Handles webhook updates in background tasks so the HTTP response does
+    not wait for them. At most max_concurrent run at once; submit() refuses
+    work once max_pending updates are waiting for a slot.
+    """
+
+    def __init__(self, max_concurrent: int = WEBHOOK_MAX_CONCURRENT, max_pending: int = WEBHOOK_MAX_PENDING):
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0, "waiting": 0, "running": 0}
+
+    def submit(self, update_data: Dict[str, Any]) -> bool:
+        if self.stats["waiting"] >= self.max_pending:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["accepted"] += 1
+        self.stats["waiting"] += 1
+        task = asyncio.get_running_loop().create_task(self._run(update_data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, update_data: Dict[str, Any]):
+        async with self._slots:
+            self.stats["waiting"] -= 1
+            self.stats["running"] += 1
+            try:
+                await process_update(update_data)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.exception(f"Update {update_data.get('update_id')} failed: {e}")
+            finally:
+                self.stats["running"] -= 1
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Waits for updates already accepted, e.g. before shutting down."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+def health_report() -> Dict[str, Any]:
+    """Runtime statistics; only reports what is already known, nothing is probed."""
+    from . import config, update_filter
+    from .services import broadcast
+    from .services.membership_cache import membership_cache
+    from .services.outbound import outbound_limiter
+    from .services.storage import storage
+    from .services.video_scheduler import video_scheduler
+    from .utils.ffmpeg_registry import known_capabilities
+    from .utils.image_processing import RENDER_CACHE
+    from .utils.render_service import render_stats
+    from .utils.video_processing import ENCODE_STATS, OVERLAY_CACHE_STATS
+
+    ffmpeg = known_capabilities()
+    ffmpeg_path = ffmpeg.get("ffmpeg") if ffmpeg else None
+    return {
+        'status': 'ok',
+        'bot_initialized': bot_initialized(),
+        'bot_username': config.BOT_USERNAME or None,
+        'update_filter': update_filter.stats,
+        'storage': storage.stats,
+        'membership_cache': membership_cache.stats(),
+        'broadcast': broadcast.stats(),
+        'outbound': outbound_limiter.stats(),
+        'render_cache': RENDER_CACHE.stats(),
+        'render_pool': render_stats(),
+        'video_jobs': video_scheduler.stats(),
+        'video_encode_attempts': ENCODE_STATS,
+        'video_overlay_cache': OVERLAY_CACHE_STATS,
+        'ffmpeg': ffmpeg or 'not_resolved_yet',
+        'ffmpeg_path': ffmpeg_path,
+        'ffmpeg_exists': os.path.exists(ffmpeg_path) if ffmpeg_path else False,
+    }
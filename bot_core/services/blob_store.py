@@ -0,0 +1,163 @@
+"""
+Content-addressed store for binary session payloads.
+
+Sessions keep only a small BlobRef (sha256 digest + size) instead of raw
+bytes, so uploaded photos, videos and rendered stickers never end up in
+the storage journal.  Blobs are reference-counted by Storage and removed
+as soon as no session points at them any more.
+"""
+import hashlib
+import mmap
+import os
+import logging
+import tempfile
+from typing import Dict, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class BlobRef:
+    __slots__ = ("digest", "size")
+
+    def __init__(self, digest: str, size: int):
+        self.digest = digest
+        self.size = size
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BlobRef) and other.digest == self.digest
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+    def __repr__(self) -> str:
+        return f"BlobRef({self.digest[:12]}, {self.size})"
+
+    def to_json(self) -> Dict[str, object]:
+        return {"__blob__": self.digest, "size": self.size}
+
+
+class BlobTooLarge(Exception):
+    """More than a BlobWriter's max_size bytes were written."""
+
+
+class BlobWriter:
+    """
+    Write-only file object that spools into the store while hashing, so
+    downloads can land in a blob without ever being held in memory.
+    commit() files the data under its digest; abort() discards it.
+    """
+
+    def __init__(self, store: "BlobStore", max_size: Optional[int] = None):
+        self._store = store
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        os.makedirs(store.root, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(suffix=".tmp", dir=store.root)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: BytesLike) -> int:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BlobTooLarge(f"blob exceeds {self.max_size} bytes")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def flush(self):
+        # Called after every downloaded chunk; buffered data reaches the file on commit().
+        pass
+
+    def commit(self) -> BlobRef:
+        self._file.close()
+        ref = BlobRef(self._hash.hexdigest(), self.size)
+        path = self._store.path(ref)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        return ref
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "BlobWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._refcounts: Dict[str, int] = {}
+        # The directory is created with the first blob, not on import.
+
+    def path(self, ref: BlobRef) -> str:
+        return os.path.join(self.root, ref.digest[:2], ref.digest)
+
+    def put(self, data: BytesLike) -> BlobRef:
+        """Stores data (if not already present) and returns its reference."""
+        ref = BlobRef(hashlib.sha256(data).hexdigest(), len(data))
+        path = self.path(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return ref
+
+    def writer(self, max_size: Optional[int] = None) -> BlobWriter:
+        return BlobWriter(self, max_size)
+
+    def read(self, ref: BlobRef) -> Optional[memoryview]:
+        """Returns a read-only, mmap-backed view of the blob without copying it."""
+        try:
+            with open(self.path(ref), "rb") as f:
+                if ref.size == 0:
+                    return memoryview(b"")
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError) as e:
+            logger.error(f"Blob {ref.digest[:12]} unavailable: {e}")
+            return None
+
+    def incref(self, digest: str):
+        self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+
+    def decref(self, digest: str):
+        count = self._refcounts.get(digest, 0) - 1
+        if count > 0:
+            self._refcounts[digest] = count
+            return
+        self._refcounts.pop(digest, None)
+        self._remove(digest)
+
+    def _remove(self, digest: str):
+        try:
+            os.remove(os.path.join(self.root, digest[:2], digest))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not remove blob {digest[:12]}: {e}")
+
+    def gc(self, live: Iterable[str]):
+        """Deletes every stored blob that is not in ``live``."""
+        live = set(live)
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name not in live:
+                    self._remove(name)
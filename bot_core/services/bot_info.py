@@ -0,0 +1,50 @@
+"""
+The bot's own identity (getMe), fetched once per process.
+
+Pack short names need the bot username, which only changes through
+@BotFather, so the User returned by getMe is kept for BOT_INFO_TTL seconds
+and its username mirrored into config.BOT_USERNAME. Read it through
+get_bot_username(); a plain `from ..config import BOT_USERNAME` copies the
+value from before startup.
+"""
+import logging
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import User
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+_me: Optional[User] = None
+_fetched_at = 0.0
+
+
+async def get_bot_info(bot: Bot, refresh: bool = False) -> User:
+    global _me, _fetched_at
+    if refresh or _me is None or time.monotonic() - _fetched_at > config.BOT_INFO_TTL:
+        # Concurrent callers share one getMe through the outbound limiter.
+        _me = await bot.get_me()
+        _fetched_at = time.monotonic()
+        config.BOT_USERNAME = _me.username
+    return _me
+
+
+async def get_bot_username(bot: Bot) -> str:
+    if _me is None and config.BOT_USERNAME:
+        # Configured explicitly; no getMe needed.
+        return config.BOT_USERNAME
+    return (await get_bot_info(bot)).username
+
+
+async def load_bot_info(bot: Bot):
+    """Startup hook: fetches the identity up front; a failure is retried on first use."""
+    if config.BOT_USERNAME:
+        return
+    try:
+        me = await get_bot_info(bot)
+        logger.info(f"Running as @{me.username}")
+    except Exception as e:
+        logger.warning(f"getMe failed at startup: {e}")
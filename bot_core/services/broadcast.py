@@ -0,0 +1,211 @@
+"""
+Admin broadcast to every known user.
+
+BROADCAST_CONCURRENCY senders share one token bucket held below Telegram's
+global limit. A broadcast sends a single message per chat, so the per-chat
+limit (about one message a second) only matters for retries, which wait out
+the RetryAfter the whole bucket was paused for, and for the admin's
+progress message, edited at most every BROADCAST_PROGRESS_INTERVAL seconds.
+Its calls also pass the outbound limiter at BULK priority, so users' own
+replies are not held up behind it.
+
+Progress is checkpointed into the admin's user record under "broadcast":
+last_uid is the highest user id below which every delivery has finished,
+so a broadcast stopped by the admin or cut short by a restart resumes from
+there through storage.iter_user_ids(after=last_uid). Users who blocked the
+bot are flagged with "blocked" and skipped until they /start again.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from ..config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES,
+    BROADCAST_PROGRESS_INTERVAL, BROADCAST_CHECKPOINT_EVERY,
+)
+from ..keyboards import admin_panel_kb, broadcast_progress_kb
+from .outbound import BULK, priority
+from .rate_limit import TokenBucket
+from .storage import storage
+
+logger = logging.getLogger(__name__)
+
+_task: Optional[asyncio.Task] = None
+_state: Optional[Dict[str, Any]] = None
+
+
+def _new_state(text: str) -> Dict[str, Any]:
+    return {"text": text, "status": "running", "last_uid": None, "sent": 0, "failed": 0,
+            "blocked": 0, "retries": 0, "started_at": int(time.time())}
+
+
+class Broadcast:
+    def __init__(self, bot: Bot, admin_id: int, state: Dict[str, Any]):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.state = state
+        self.bucket = TokenBucket(BROADCAST_RATE)
+        self._uids = None
+        # Dispatched uids in ascending order with a "finished" flag, for last_uid.
+        self._order: deque = deque()
+        self._since_checkpoint = 0
+        self._progress_message_id: Optional[int] = None
+        self._progress_at = 0.0
+
+    async def run(self):
+        # Runs as its own task, so this only demotes the broadcast's own calls.
+        priority.set(BULK)
+        self.state["status"] = "running"
+        self._checkpoint()
+        await self._report(force=True)
+        # New users may still be in the write-behind buffer; the cursor only sees written ones.
+        await storage.flush_async()
+        # Blocked users are filtered by the query, so no record is loaded per recipient.
+        self._uids = storage.iter_user_ids(after=self.state["last_uid"], skip_blocked=True)
+        try:
+            await asyncio.gather(*(self._worker() for _ in range(BROADCAST_CONCURRENCY)))
+            self.state["status"] = "done"
+        except asyncio.CancelledError:
+            self.state["status"] = "paused"
+            raise
+        finally:
+            self._checkpoint()
+            await self._report(force=True)
+
+    async def _worker(self):
+        while True:
+            uid = next(self._uids, None)
+            if uid is None:
+                return
+            entry = [uid, False]
+            self._order.append(entry)
+            await self._deliver(uid)
+            entry[1] = True
+            while self._order and self._order[0][1]:
+                self.state["last_uid"] = self._order.popleft()[0]
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= BROADCAST_CHECKPOINT_EVERY:
+                self._checkpoint()
+            await self._report()
+
+    async def _deliver(self, uid: int):
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(uid, self.state["text"])
+                self.state["sent"] += 1
+                return
+            except TelegramRetryAfter as e:
+                self.state["retries"] += 1
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                self._mark_blocked(uid)
+                return
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    self._mark_blocked(uid)
+                else:
+                    self.state["failed"] += 1
+                return
+            except Exception as e:
+                logger.warning(f"Broadcast to {uid} failed: {e}")
+                self.state["failed"] += 1
+                return
+        self.state["failed"] += 1
+
+    def _mark_blocked(self, uid: int):
+        self.state["blocked"] += 1
+        storage.update_user(uid, {"blocked": True})
+
+    def _checkpoint(self):
+        self._since_checkpoint = 0
+        storage.update_user(self.admin_id, {"broadcast": self.state})
+
+    async def _report(self, force: bool = False):
+        """Sends, then keeps editing, one progress message to the admin."""
+        now = time.monotonic()
+        if not force and now - self._progress_at < BROADCAST_PROGRESS_INTERVAL:
+            return
+        self._progress_at = now
+        running = self.state["status"] == "running"
+        markup = broadcast_progress_kb() if running else admin_panel_kb(resumable=self.state["status"] == "paused")
+        text = progress_text(self.state)
+        try:
+            await self.bucket.acquire()
+            if self._progress_message_id is None:
+                message = await self.bot.send_message(self.admin_id, text, reply_markup=markup)
+                self._progress_message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.admin_id, message_id=self._progress_message_id, reply_markup=markup)
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+        except Exception as e:
+            # "message is not modified" and the like; progress is best effort.
+            logger.debug(f"Broadcast progress update failed: {e}")
+
+
+def progress_text(state: Dict[str, Any]) -> str:
+    title = {"running": "در حال ارسال پیام همگانی...", "paused": "پیام همگانی متوقف شد.", "done": "پیام همگانی تمام شد."}[state["status"]]
+    return (f"{title}\n\n"
+            f"ارسال شده: {state['sent']}\n"
+            f"مسدود کرده‌اند: {state['blocked']}\n"
+            f"ناموفق: {state['failed']}")
+
+
+def is_running() -> bool:
+    return _task is not None and not _task.done()
+
+
+def checkpoint(admin_id: int) -> Optional[Dict[str, Any]]:
+    return storage.get_user(admin_id).get("broadcast")
+
+
+def can_resume(admin_id: int) -> bool:
+    state = checkpoint(admin_id)
+    # A "running" checkpoint without a task was interrupted by a restart.
+    return bool(state) and state["status"] != "done" and not is_running()
+
+
+def _start(bot: Bot, admin_id: int, state: Dict[str, Any]):
+    global _task, _state
+    _state = state
+    _task = asyncio.get_running_loop().create_task(Broadcast(bot, admin_id, state).run())
+    _task.add_done_callback(_log_result)
+
+
+def _log_result(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Broadcast failed: {task.exception()}")
+
+
+def start_broadcast(bot: Bot, admin_id: int, text: str) -> bool:
+    if is_running():
+        return False
+    _start(bot, admin_id, _new_state(text))
+    return True
+
+
+def resume_broadcast(bot: Bot, admin_id: int) -> bool:
+    if not can_resume(admin_id):
+        return False
+    _start(bot, admin_id, dict(checkpoint(admin_id)))
+    return True
+
+
+def stop_broadcast() -> bool:
+    if not is_running():
+        return False
+    _task.cancel()
+    return True
+
+
+def stats() -> Optional[Dict[str, Any]]:
+    """Counters of the broadcast started by this process, if any."""
+    if _state is None:
+        return None
+    return dict({k: v for k, v in _state.items() if k != "text"}, running=is_running())
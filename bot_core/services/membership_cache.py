@@ -0,0 +1,83 @@
+"""
+TTL cache for channel membership lookups.
+
+Members are remembered for MEMBERSHIP_TTL_POSITIVE seconds, non-members
+(and failed lookups) for the much shorter MEMBERSHIP_TTL_NEGATIVE so that
+someone who just joined is not kept waiting. Concurrent checks for the
+same user share one get_chat_member call.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from ..config import MEMBERSHIP_TTL_POSITIVE, MEMBERSHIP_TTL_NEGATIVE, MEMBERSHIP_CACHE_SIZE
+
+
+class MembershipCache:
+    def __init__(self, positive_ttl: float, negative_ttl: float, max_entries: int):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: Dict[int, Tuple[bool, float]] = {}  # uid -> (is_member, expires_at)
+        self._in_flight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get(self, uid: int, lookup: Callable[[], Awaitable[bool]]) -> bool:
+        entry = self._entries.get(uid)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+
+        pending = self._in_flight.get(uid)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[uid] = future
+        try:
+            is_member = await lookup()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception:
+            is_member = False
+        finally:
+            self._in_flight.pop(uid, None)
+        self._put(uid, is_member)
+        future.set_result(is_member)
+        return is_member
+
+    def _put(self, uid: int, is_member: bool):
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._entries.pop(uid, None)
+        self._entries[uid] = (is_member, time.monotonic() + ttl)
+        if len(self._entries) > self.max_entries:
+            now = time.monotonic()
+            for key in [k for k, (_, expires) in self._entries.items() if expires <= now]:
+                del self._entries[key]
+            # Still full: drop the oldest entries (dicts keep insertion order).
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, uid: int):
+        if self._entries.pop(uid, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+membership_cache = MembershipCache(MEMBERSHIP_TTL_POSITIVE, MEMBERSHIP_TTL_NEGATIVE, MEMBERSHIP_CACHE_SIZE)
@@ -0,0 +1,160 @@
+"""
+Pacing of every outgoing Bot API call.
+
+OutboundLimiter is an aiogram request middleware, registered on the session
+by create_session(), so handlers keep calling bot.send_message & co.
+directly. Before a call goes out it waits for a token from its chat's
+bucket (calls that post or edit messages in a chat, CHAT_PACED_METHODS)
+and then from the global bucket, where
+interactive replies are served before bulk traffic: code that sends in bulk
+(broadcasts) sets the priority for its task with `priority.set(BULK)`.
+
+A RetryAfter is waited out on the bucket that was throttled and the call is
+repeated. Identical read-only calls already in flight (getMe, getFile, ...)
+share one request. Time spent queued is recorded per priority for
+/health.
+"""
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from ..config import (
+    TELEGRAM_API_BASE, OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+    OUTBOUND_MAX_RETRIES, OUTBOUND_MAX_RETRY_AFTER,
+)
+from .rate_limit import PriorityTokenBucket, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+priority: ContextVar[int] = ContextVar("outbound_priority", default=INTERACTIVE)
+
+# Not paced: long polling, startup calls and callback answers the user is waiting on.
+UNLIMITED_METHODS = {"getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo", "answerCallbackQuery"}
+# Read-only calls that can share one request while an identical one is in flight.
+COALESCED_METHODS = {"getMe", "getFile", "getChat", "getChatMember", "getStickerSet"}
+# Calls that post or edit messages in their chat_id, paced per chat as well.
+# Reads that merely name a chat (getChatMember on the channel for every
+# user, getChat, ...) only take a global token.
+CHAT_PACED_METHODS = {
+    "sendMessage", "sendPhoto", "sendSticker", "sendDocument", "sendVideo", "sendAnimation",
+    "sendAudio", "sendVoice", "sendVideoNote", "sendMediaGroup", "sendLocation", "sendVenue",
+    "sendContact", "sendPoll", "sendDice", "sendChatAction", "copyMessage", "copyMessages",
+    "forwardMessage", "forwardMessages", "editMessageText", "editMessageCaption",
+    "editMessageMedia", "editMessageReplyMarkup",
+}
+# Idle per-chat buckets are dropped once there are more than this many.
+MAX_CHAT_BUCKETS = 10000
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = PriorityTokenBucket(global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.stats_by_priority = {name: {"requests": 0, "wait_total": 0.0, "wait_max": 0.0} for name in PRIORITY_NAMES.values()}
+        self.retries = 0
+        self.coalesced = 0
+
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        if api_method in COALESCED_METHODS:
+            return await self._coalesced(make_request, bot, method)
+        return await self._send(make_request, bot, method)
+
+    async def _coalesced(self, make_request, bot, method):
+        key = (method.__api_method__, method.model_dump_json(exclude_none=True))
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._send(make_request, bot, method)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve it here so it is not reported as unhandled when nobody joined.
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    async def _send(self, make_request, bot, method):
+        if method.__api_method__ in UNLIMITED_METHODS:
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None) if method.__api_method__ in CHAT_PACED_METHODS else None
+        for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+            await self._wait_turn(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= OUTBOUND_MAX_RETRIES or e.retry_after > OUTBOUND_MAX_RETRY_AFTER:
+                    raise
+                self.retries += 1
+                logger.warning(f"{method.__api_method__} throttled for {e.retry_after}s (chat {chat_id})")
+                (self._chat_bucket(chat_id) if chat_id is not None else self._global).pause(e.retry_after)
+
+    async def _wait_turn(self, chat_id):
+        level = priority.get()
+        started = time.monotonic()
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire(level)
+        waited = time.monotonic() - started
+        stats = self.stats_by_priority[PRIORITY_NAMES.get(level, "bulk")]
+        stats["requests"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._prune()
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune(self):
+        for key in [k for k, bucket in self._chats.items() if bucket.idle()]:
+            del self._chats[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._global.waiting,
+            "chats": len(self._chats),
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            **{name: {"requests": s["requests"],
+                      "wait_avg_ms": round(s["wait_total"] / s["requests"] * 1000, 1) if s["requests"] else 0.0,
+                      "wait_max_ms": round(s["wait_max"] * 1000, 1)}
+               for name, s in self.stats_by_priority.items()},
+        }
+
+
+outbound_limiter = OutboundLimiter(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+
+
+def create_session():
+    """aiohttp session for a Bot, pointed at TELEGRAM_API_BASE if set, with the limiter installed."""
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else AiohttpSession()
+    session.middleware(outbound_limiter)
+    return session
@@ -0,0 +1,75 @@
+"""
+Putting several stickers into a pack at once.
+
+A pack that does not exist yet is created with up to MAX_INITIAL_STICKERS
+stickers in a single createNewStickerSet call. Whatever is left, or a batch
+for an existing pack, is pipelined: uploadStickerFile runs for up to
+PACK_UPLOAD_CONCURRENCY stickers ahead, while addStickerToSet follows one
+call at a time with the uploaded file_ids, so the pack keeps the order the
+stickers were given in. Every call is paced by the outbound limiter.
+"""
+import asyncio
+import logging
+from typing import List, Tuple, Union
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, InputSticker
+
+from ..config import PACK_UPLOAD_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# createNewStickerSet accepts 1-50 initial stickers.
+MAX_INITIAL_STICKERS = 50
+EMOJI = "😀"
+
+
+def input_sticker(sticker: Union[str, bytes], sticker_format: str) -> InputSticker:
+    """A file_id (str) is sent as is, bytes are uploaded with the request."""
+    if isinstance(sticker, (bytes, bytearray, memoryview)):
+        sticker = BufferedInputFile(bytes(sticker), "s.webm" if sticker_format == "video" else "s.webp")
+    return InputSticker(sticker=sticker, format=sticker_format, emoji_list=[EMOJI])
+
+
+async def build_pack(bot: Bot, uid: int, name: str, title: str, stickers: List[Union[str, bytes]],
+                     sticker_format: str = "static", create: bool = False) -> Tuple[int, int]:
+    """
+    Creates the pack (create=True) or extends it with the given stickers.
+    Returns (added, failed). A failed createNewStickerSet raises, since
+    nothing was added; later failures only count.
+    """
+    added = 0
+    rest = stickers
+    if create:
+        initial, rest = stickers[:MAX_INITIAL_STICKERS], stickers[MAX_INITIAL_STICKERS:]
+        await bot.create_new_sticker_set(user_id=uid, name=name, title=title,
+                                         stickers=[input_sticker(s, sticker_format) for s in initial])
+        added = len(initial)
+    if not rest:
+        return added, 0
+
+    slots = asyncio.Semaphore(PACK_UPLOAD_CONCURRENCY)
+
+    async def upload(sticker: Union[str, bytes]) -> str:
+        if isinstance(sticker, str):
+            return sticker
+        async with slots:
+            file = await bot.upload_sticker_file(user_id=uid, sticker=input_sticker(sticker, sticker_format).sticker,
+                                                 sticker_format=sticker_format)
+            return file.file_id
+
+    uploads = [asyncio.ensure_future(upload(s)) for s in rest]
+    failed = 0
+    try:
+        for upload_task in uploads:
+            try:
+                file_id = await upload_task
+                await bot.add_sticker_to_set(user_id=uid, name=name, sticker=input_sticker(file_id, sticker_format))
+                added += 1
+            except Exception as e:
+                logger.warning(f"Adding a sticker to {name} failed: {e}")
+                failed += 1
+    finally:
+        for upload_task in uploads:
+            upload_task.cancel()
+    return added, failed
@@ -0,0 +1,97 @@
+"""
+Token buckets for pacing outgoing Bot API calls.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second with bursts of up to `capacity`.
+    Waiters are served in arrival order. pause() stops every acquisition
+    until the given delay has passed, e.g. after a RetryAfter from Telegram.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        # Nothing accrues while paused, so a pause is not followed by a burst.
+        elapsed = now - max(self._updated, self._paused_until)
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def idle(self) -> bool:
+        """Full and nobody waiting: dropping the bucket would change nothing."""
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+
+class PriorityTokenBucket(TokenBucket):
+    """
+    TokenBucket whose waiters are served lowest priority value first, then
+    in arrival order. One releaser task hands out tokens while anyone waits.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        super().__init__(rate, capacity)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._releaser: Optional[asyncio.Task] = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int = 0):
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and now >= self._paused_until and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.get_running_loop().create_task(self._release())
+        await future
+
+    async def _release(self):
+        while self._waiters:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+            elif self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+            else:
+                future = heapq.heappop(self._waiters)[2]
+                # Waiters that gave up (cancelled) do not use a token.
+                if not future.done():
+                    self._tokens -= 1
+                    future.set_result(None)
@@ -1,50 +1,267 @@
+import asyncio
 import json
 import os
 import base64
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple, Union
+from ..config import STORAGE_ENGINE, STORAGE_WRITE_BEHIND, STORAGE_FLUSH_INTERVAL, STORAGE_FLUSH_THRESHOLD
 from ..utils.helpers import _today_start_ts
+from .blob_store import BlobRef, BlobStore
+from .storage_engines import StorageEngine, create_engine
 
 STORAGE_FILE = "/tmp/bot_storage.json" if os.environ.get("VERCEL") else "bot_storage.json"
+BLOB_DIR = "/tmp/bot_blobs" if os.environ.get("VERCEL") else "bot_blobs"
 
 def _json_encode_helper(obj):
+    if isinstance(obj, BlobRef):
+        return obj.to_json()
     if isinstance(obj, bytes):
         return {"__bytes__": base64.b64encode(obj).decode("utf-8")}
     return obj
 
 def _json_decode_helper(obj):
+    if isinstance(obj, dict) and "__blob__" in obj:
+        return BlobRef(obj["__blob__"], obj.get("size", 0))
     if isinstance(obj, dict) and "__bytes__" in obj:
         return base64.b64decode(obj["__bytes__"])
     return obj
 
+def _externalize(value: Any, blobs: BlobStore, refs: Set[str]) -> bool:
+    """Moves raw bytes found in a session into the blob store, in place, and collects the refs."""
+    moved = False
+    items = value.items() if isinstance(value, dict) else enumerate(value) if isinstance(value, list) else ()
+    for k, v in items:
+        if isinstance(v, (bytes, bytearray)):
+            v = value[k] = blobs.put(v)
+            moved = True
+        if isinstance(v, BlobRef):
+            refs.add(v.digest)
+        elif isinstance(v, (dict, list)):
+            moved = _externalize(v, blobs, refs) or moved
+    return moved
+
 class Storage:
-    def __init__(self):
+    def __init__(self, engine: Optional[StorageEngine] = None, blobs: Optional[BlobStore] = None):
         self.USERS: Dict[str, Dict[str, Any]] = {}
         self.SESSIONS: Dict[str, Dict[str, Any]] = {}
+        self.engine = engine or create_engine(STORAGE_ENGINE, STORAGE_FILE)
+        self.blobs = blobs or BlobStore(BLOB_DIR)
+        self._session_refs: Dict[str, Set[str]] = {}
+        # Write-behind state; inactive until start_write_behind() runs inside the event loop.
+        self._dirty: Dict[Tuple[str, str], None] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.stats = {"writes": 0, "writes_coalesced": 0, "records_flushed": 0, "flushes": 0}
         self.load()
 
     def load(self):
-        if os.path.exists(STORAGE_FILE):
-            try:
-                with open(STORAGE_FILE, "r") as f:
-                    data = json.load(f, object_hook=_json_decode_helper)
-                    self.USERS = data.get("users", {})
-                    self.SESSIONS = data.get("sessions", {})
-            except Exception as e:
-                print(f"Error loading storage: {e}")
+        try:
+            tables = self.engine.load()
+            self.USERS = {k: self._decode(v) for k, v in tables.get("users", {}).items()}
+            self.SESSIONS = {k: self._decode(v) for k, v in tables.get("sessions", {}).items()}
+            legacy = []
+            for uid_str, session in self.SESSIONS.items():
+                refs: Set[str] = set()
+                if _externalize(session, self.blobs, refs):
+                    legacy.append(("sessions", uid_str))
+                self._session_refs[uid_str] = refs
+                for digest in refs:
+                    self.blobs.incref(digest)
+            self.blobs.gc(set().union(*self._session_refs.values()))
+            if legacy:
+                self._persist(*legacy)
+        except Exception as e:
+            print(f"Error loading storage: {e}")
+
+    def _track_blobs(self, uid_str: str):
+        """Externalizes bytes in a session and adjusts blob refcounts against its last persisted state."""
+        session = self.SESSIONS.get(uid_str)
+        refs: Set[str] = set()
+        if session is not None:
+            _externalize(session, self.blobs, refs)
+        old_refs = self._session_refs.get(uid_str, set())
+        for digest in refs - old_refs:
+            self.blobs.incref(digest)
+        for digest in old_refs - refs:
+            self.blobs.decref(digest)
+        self._session_refs[uid_str] = refs
+
+    def read_blob(self, value: Union[BlobRef, bytes, None]) -> Optional[Union[memoryview, bytes]]:
+        """Resolves a session payload to bytes-like data; plain bytes pass through."""
+        if isinstance(value, BlobRef):
+            return self.blobs.read(value)
+        return value
+
+    def blob_path(self, value: Union[BlobRef, bytes, None]) -> Optional[str]:
+        """On-disk path of a stored payload, for tools (ffmpeg) that read files directly."""
+        if isinstance(value, BlobRef):
+            return self.blobs.path(value)
+        return None
+
+    def hold_blob(self, value: Union[BlobRef, bytes, None]):
+        """Keeps a stored payload on disk for a job that reads it after the session may have let go; pair with release_blob()."""
+        if isinstance(value, BlobRef):
+            self.blobs.incref(value.digest)
 
-    def save(self):
+    def release_blob(self, value: Union[BlobRef, bytes, None]):
+        if isinstance(value, BlobRef):
+            self.blobs.decref(value.digest)
+
+    @staticmethod
+    def _encode(value: Any) -> str:
+        return json.dumps(value, default=_json_encode_helper)
+
+    @staticmethod
+    def _decode(raw: str) -> Any:
+        return json.loads(raw, object_hook=_json_decode_helper)
+
+    def _persist(self, *keys):
+        """Writes only the given ``(table, uid_str)`` records, or marks them dirty under write-behind."""
+        self.stats["writes"] += len(keys)
+        for key in keys:
+            if key[0] == "sessions":
+                self._track_blobs(key[1])
+        if self._flush_task is None:
+            self._write(self._encode_records(keys))
+            return
+        for key in keys:
+            if key in self._dirty:
+                self.stats["writes_coalesced"] += 1
+            else:
+                self._dirty[key] = None
+        if len(self._dirty) >= STORAGE_FLUSH_THRESHOLD:
+            self._flush_wakeup.set()
+
+    def _encode_records(self, keys) -> List[Tuple[str, str, Optional[str]]]:
+        records = []
+        for table, uid_str in keys:
+            value = (self.USERS if table == "users" else self.SESSIONS).get(uid_str)
+            records.append((table, uid_str, self._encode(value) if value is not None else None))
+        return records
+
+    def _write(self, records):
         try:
-            with open(STORAGE_FILE, "w") as f:
-                json.dump({
-                    "users": self.USERS,
-                    "sessions": self.SESSIONS
-                }, f, default=_json_encode_helper)
+            self.engine.write(records)
         except Exception as e:
             print(f"Error saving storage: {e}")
+            return
+        self.stats["records_flushed"] += len(records)
+        self.stats["flushes"] += 1
+
+    def _take_dirty(self) -> List[Tuple[str, str, Optional[str]]]:
+        keys, self._dirty = list(self._dirty), {}
+        records = []
+        for key in keys:
+            try:
+                records.extend(self._encode_records([key]))
+            except Exception as e:
+                # Keep the change pending instead of dropping it; the rest still goes out.
+                print(f"Error encoding {key[0]} record {key[1]}: {e}")
+                self._dirty[key] = None
+        return records
+
+    def flush(self):
+        """Synchronously writes every pending dirty record."""
+        if self._dirty:
+            self._write(self._take_dirty())
+
+    async def flush_async(self):
+        """Writes pending dirty records from a worker thread; records are encoded on the loop first."""
+        if not self._dirty:
+            return
+        if self._flush_lock is None:
+            self.flush()
+            return
+        # The lock keeps flushes in order so an older encoding never lands after a newer one.
+        async with self._flush_lock:
+            records = self._take_dirty()
+            if records:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, records)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=STORAGE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            try:
+                await self.flush_async()
+            except Exception as e:
+                print(f"Error flushing storage: {e}")
+
+    @staticmethod
+    def _flush_task_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Storage flusher stopped, writes now only reach memory: {task.exception()}")
+
+    def start_write_behind(self):
+        """Switches to write-behind mode; must be called from inside the running event loop."""
+        if not STORAGE_WRITE_BEHIND or self._flush_task is not None:
+            return
+        self._flush_wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+        self._flush_task.add_done_callback(self._flush_task_done)
+
+    async def stop_write_behind(self):
+        """Stops the background flusher and writes everything still pending."""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush_async()
+
+    def save(self, uid: Optional[int] = None):
+        """Persists one user's record and session, or everything when uid is omitted."""
+        if uid is not None:
+            uid_str = str(uid)
+            self._persist(*[(table, uid_str) for table, cache in (("users", self.USERS), ("sessions", self.SESSIONS)) if uid_str in cache])
+            return
+        self._persist(*[("users", k) for k in self.USERS], *[("sessions", k) for k in self.SESSIONS])
+        if self._flush_task is not None:
+            # A synchronous flush could overtake one already running in the executor.
+            self._flush_wakeup.set()
+            return
+        self.engine.compact()
+
+    def close(self):
+        self.flush()
+        self.engine.close()
+
+    def _cached(self, table: str, uid_str: str) -> bool:
+        """Checks the in-memory cache, pulling the record from a lazy engine on a miss."""
+        cache = self.USERS if table == "users" else self.SESSIONS
+        if uid_str in cache:
+            return True
+        if not self.engine.lazy:
+            return False
+        raw = self.engine.fetch(table, uid_str)
+        if raw is None:
+            return False
+        cache[uid_str] = self._decode(raw)
+        return True
+
+    def iter_user_ids(self, after: Optional[int] = None, skip_blocked: bool = False) -> Iterator[int]:
+        """
+        Yields every known user id in ascending order, optionally resuming after a given id
+        and leaving out users flagged "blocked". Records are not loaded into the cache.
+        Under write-behind, await flush_async() first: a lazy engine only lists users already written.
+        """
+        if self.engine.lazy:
+            keys = self.engine.iter_keys("users", after, skip_blocked)
+        else:
+            keys = (k for k in sorted(self.USERS, key=int)
+                    if (after is None or int(k) > after) and not (skip_blocked and self.USERS[k].get("blocked")))
+        for key in keys:
+            yield int(key)
 
     def get_user(self, uid: int) -> Dict[str, Any]:
         uid_str = str(uid)
-        if uid_str not in self.USERS:
+        if not self._cached("users", uid_str):
             self.USERS[uid_str] = {
                 "ai_used": 0,
                 "vote": None,
@@ -53,12 +270,12 @@ class Storage:
                 "current_pack": None,
                 "daily_limit": None
             }
-            self.save()
+            self._persist(("users", uid_str))
         return self.USERS[uid_str]
 
     def get_session(self, uid: int) -> Dict[str, Any]:
         uid_str = str(uid)
-        if uid_str not in self.SESSIONS:
+        if not self._cached("sessions", uid_str):
             self.reset_session(uid)
         return self.SESSIONS[uid_str]
 
@@ -75,14 +292,18 @@ class Storage:
             "current_pack_title": None,
             "admin": {}
         }
-        self.save()
+        self._persist(("sessions", uid_str))
 
     def update_session(self, uid: int, data: Dict[str, Any]):
         uid_str = str(uid)
-        if uid_str not in self.SESSIONS:
+        if not self._cached("sessions", uid_str):
             self.reset_session(uid)
         self.SESSIONS[uid_str].update(data)
-        self.save()
+        self._persist(("sessions", uid_str))
+
+    def update_user(self, uid: int, data: Dict[str, Any]):
+        self.get_user(uid).update(data)
+        self._persist(("users", str(uid)))
 
     def get_user_packs(self, uid: int) -> List[Dict[str, str]]:
         return self.get_user(uid).get("packs", [])
@@ -93,13 +314,18 @@ class Storage:
         if not any(p["short_name"] == pack_short_name for p in packs):
             packs.append({"name": pack_name, "short_name": pack_short_name})
         u["current_pack"] = pack_short_name
-        self.save()
+        self._persist(("users", str(uid)))
 
     def set_current_pack(self, uid: int, pack_short_name: str):
         self.get_user(uid)["current_pack"] = pack_short_name
-        self.save()
+        self._persist(("users", str(uid)))
 
     def get_current_pack(self, uid: int) -> Optional[Dict[str, str]]:
+        uid_str = str(uid)
+        # A cached record is never older than the engine's copy (a flush may
+        # still be writing it), so the engine is only asked for uncached users.
+        if self.engine.lazy and uid_str not in self.USERS:
+            return self.engine.current_pack(uid_str)
         u = self.get_user(uid)
         short_name = u.get("current_pack")
         return next((p for p in u.get("packs", []) if p["short_name"] == short_name), None)
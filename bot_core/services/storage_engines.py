@@ -0,0 +1,487 @@
+"""
+Persistence backends for Storage.
+
+Storage keeps users and sessions in memory and hands every change to an
+engine as a list of records ``(table, key, raw)`` where ``raw`` is the
+record already encoded as JSON (``None`` deletes the key).  Engines only
+deal with those strings, so they never touch the live dicts and can do
+their I/O from any thread.
+"""
+import json
+import os
+import sqlite3
+import threading
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..config import STORAGE_COMPACT_EVERY, STORAGE_FSYNC
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("users", "sessions")
+
+Record = Tuple[str, str, Optional[str]]
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _dump_tables(tables: Dict[str, Dict[str, str]]) -> str:
+    """Builds the snapshot document from already-encoded records."""
+    parts = []
+    for table in TABLES:
+        rows = tables.get(table, {})
+        body = ",".join(f"{json.dumps(k)}:{v}" for k, v in rows.items())
+        parts.append(f"{json.dumps(table)}:{{{body}}}")
+    return "{" + ",".join(parts) + "}"
+
+
+def _atomic_write(path: str, data: str, fsync: bool = True):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        _fsync_dir(path)
+
+
+def _read_snapshot(path: str) -> Dict[str, Dict[str, str]]:
+    """Reads a snapshot file and re-encodes each record on its own."""
+    tables: Dict[str, Dict[str, str]] = {t: {} for t in TABLES}
+    if not os.path.exists(path):
+        return tables
+    with open(path, "r") as f:
+        data = json.load(f)
+    for table in TABLES:
+        for key, value in (data.get(table) or {}).items():
+            tables[table][key] = json.dumps(value)
+    return tables
+
+
+class StorageEngine:
+    """Base class for storage backends."""
+
+    name = "base"
+    # Lazy engines only return part of the data from load(); Storage asks
+    # them for the remaining records one key at a time through fetch().
+    lazy = False
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        """Returns ``{table: {key: raw}}`` for everything persisted so far."""
+        raise NotImplementedError
+
+    def write(self, records: List[Record]):
+        """Persists the given records. Called with one batch per change set."""
+        raise NotImplementedError
+
+    def fetch(self, table: str, key: str) -> Optional[str]:
+        """Returns a single record (lazy engines only)."""
+        return None
+
+    def iter_keys(self, table: str, after: Optional[int] = None, skip_blocked: bool = False) -> Iterator[str]:
+        """Streams keys in ascending numeric order (lazy engines only); skip_blocked leaves out users flagged "blocked"."""
+        raise NotImplementedError
+
+    def current_pack(self, key: str) -> Optional[Dict[str, str]]:
+        """Indexed lookup of a user's current pack (lazy engines only)."""
+        raise NotImplementedError
+
+    def compact(self, wait: bool = False):
+        """Folds pending deltas into a snapshot, if the engine keeps any."""
+
+    def close(self):
+        """Flushes everything and releases file handles."""
+
+
+class JsonFileEngine(StorageEngine):
+    """Legacy backend: rewrites the whole JSON file on every write."""
+
+    name = "json"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tables: Dict[str, Dict[str, str]] = {t: {} for t in TABLES}
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        self._tables = _read_snapshot(self.path)
+        return {t: dict(rows) for t, rows in self._tables.items()}
+
+    def write(self, records: List[Record]):
+        with self._lock:
+            for table, key, raw in records:
+                if raw is None:
+                    self._tables[table].pop(key, None)
+                else:
+                    self._tables[table][key] = raw
+            _atomic_write(self.path, _dump_tables(self._tables), fsync=False)
+
+
+class JournalEngine(StorageEngine):
+    """
+    Append-only journal of per-key records on top of a JSON snapshot.
+
+    Every write appends one line per changed key to ``<path>.journal``, so
+    the cost of a write depends only on the records it touches.  Once the
+    journal holds ``compact_every`` lines it is rotated to
+    ``<path>.journal.old`` and a background thread writes a fresh snapshot
+    (temp file + fsync + ``os.replace``) before dropping the rotated
+    journal.  On load the snapshot is read first and both journals are
+    replayed on top; records are whole values, so replay is idempotent and
+    a crash at any point of a compaction loses nothing.  A torn last line
+    from a crash mid-append is skipped.
+
+    The snapshot has the same layout as the legacy ``bot_storage.json``, so
+    an existing file is picked up as the initial snapshot.
+    """
+
+    name = "journal"
+
+    def __init__(self, path: str, compact_every: int = 2000, fsync: bool = False):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.rotated_path = f"{path}.journal.old"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._tables: Dict[str, Dict[str, str]] = {t: {} for t in TABLES}
+        self._journal = None
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        with self._lock:
+            self._tables = _read_snapshot(self.path)
+            replayed = 0
+            for journal in (self.rotated_path, self.journal_path):
+                replayed += self._replay(journal)
+            self._journal_lines = replayed
+            tables = {t: dict(rows) for t, rows in self._tables.items()}
+        # A leftover rotated journal means a compaction was interrupted.
+        if os.path.exists(self.rotated_path) or replayed >= self.compact_every:
+            self.compact(wait=True)
+        return tables
+
+    def _replay(self, journal_path: str) -> int:
+        if not os.path.exists(journal_path):
+            return 0
+        count = 0
+        with open(journal_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    table, key, value = entry["t"], entry["k"], entry["v"]
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Skipping corrupt journal line in {journal_path}")
+                    continue
+                if table not in self._tables:
+                    continue
+                if value is None:
+                    self._tables[table].pop(key, None)
+                else:
+                    self._tables[table][key] = json.dumps(value)
+                count += 1
+        return count
+
+    def _open_journal(self):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a")
+
+    def write(self, records: List[Record]):
+        if not records:
+            return
+        lines = []
+        with self._lock:
+            for table, key, raw in records:
+                if raw is None:
+                    self._tables[table].pop(key, None)
+                else:
+                    self._tables[table][key] = raw
+                lines.append(f'{{"t":{json.dumps(table)},"k":{json.dumps(key)},"v":{raw if raw is not None else "null"}}}\n')
+            self._open_journal()
+            self._journal.write("".join(lines))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._journal_lines += len(lines)
+            should_compact = self._journal_lines >= self.compact_every
+        if should_compact:
+            self.compact()
+
+    def compact(self, wait: bool = False):
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                compactor = self._compactor
+            else:
+                self._rotate()
+                tables = {t: dict(rows) for t, rows in self._tables.items()}
+                compactor = threading.Thread(target=self._write_snapshot, args=(tables,), name="storage-compactor", daemon=True)
+                self._compactor = compactor
+                compactor.start()
+        if wait:
+            compactor.join()
+
+    def _rotate(self):
+        """Moves the live journal aside. Must be called with the lock held."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.rotated_path):
+                # Previous compaction never finished: keep both sets of deltas.
+                with open(self.journal_path, "r") as src, open(self.rotated_path, "a") as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+        # The next write() reopens it; nothing is created until there is data.
+        self._journal_lines = 0
+
+    def _write_snapshot(self, tables: Dict[str, Dict[str, str]]):
+        try:
+            _atomic_write(self.path, _dump_tables(tables))
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+            logger.info(f"Storage compacted: {sum(len(r) for r in tables.values())} records")
+        except Exception as e:
+            logger.error(f"Storage compaction failed: {e}")
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+
+
+USER_COLUMNS = ("ai_used", "day_start", "current_pack", "daily_limit")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid INTEGER PRIMARY KEY,
+    ai_used INTEGER NOT NULL DEFAULT 0,
+    day_start INTEGER,
+    current_pack TEXT,
+    daily_limit INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS packs (
+    uid INTEGER NOT NULL,
+    short_name TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (uid, short_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS packs_by_position ON packs (uid, position);
+CREATE TABLE IF NOT EXISTS sessions (
+    uid INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+# Statements are kept as constants so sqlite3's statement cache reuses the
+# prepared form on every call.
+SQL_UPSERT_USER = (
+    "INSERT INTO users (uid, ai_used, day_start, current_pack, daily_limit, extra) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(uid) DO UPDATE SET ai_used=excluded.ai_used, day_start=excluded.day_start, "
+    "current_pack=excluded.current_pack, daily_limit=excluded.daily_limit, extra=excluded.extra"
+)
+SQL_UPSERT_PACK = (
+    "INSERT INTO packs (uid, short_name, name, position) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(uid, short_name) DO UPDATE SET name=excluded.name, position=excluded.position"
+)
+SQL_TRIM_PACKS = "DELETE FROM packs WHERE uid = ? AND position >= ?"
+SQL_DELETE_USER = "DELETE FROM users WHERE uid = ?"
+SQL_DELETE_PACKS = "DELETE FROM packs WHERE uid = ?"
+SQL_SELECT_USER = "SELECT ai_used, day_start, current_pack, daily_limit, extra FROM users WHERE uid = ?"
+SQL_SELECT_PACKS = "SELECT name, short_name FROM packs WHERE uid = ? ORDER BY position"
+SQL_CURRENT_PACK = (
+    "SELECT p.name, p.short_name FROM users u "
+    "JOIN packs p ON p.uid = u.uid AND p.short_name = u.current_pack WHERE u.uid = ?"
+)
+SQL_UPSERT_SESSION = "INSERT INTO sessions (uid, data) VALUES (?, ?) ON CONFLICT(uid) DO UPDATE SET data=excluded.data"
+SQL_DELETE_SESSION = "DELETE FROM sessions WHERE uid = ?"
+SQL_SELECT_SESSION = "SELECT data FROM sessions WHERE uid = ?"
+SQL_BLOB_SESSIONS = "SELECT uid, data FROM sessions WHERE data LIKE '%\"__blob__\"%' OR data LIKE '%\"__bytes__\"%'"
+SQL_USER_IDS = "SELECT uid FROM users WHERE uid > ? ORDER BY uid LIMIT ?"
+# "blocked" lives in the extra JSON; true reads back as 1, a missing key as NULL.
+SQL_REACHABLE_USER_IDS = "SELECT uid FROM users WHERE uid > ? AND json_extract(extra, '$.blocked') IS NOT 1 ORDER BY uid LIMIT ?"
+
+
+class SqliteEngine(StorageEngine):
+    """
+    SQLite backend with one row per user and per session.
+
+    Users are split into typed columns plus an ``extra`` JSON column for
+    the remaining keys, and their packs live in a separate table keyed by
+    ``(uid, short_name)`` so the current pack is a primary-key lookup.
+    The engine is lazy: load() only returns sessions that hold blob
+    references (Storage must track those from the start), everything else
+    is fetched per user on first access.
+    """
+
+    name = "sqlite"
+    lazy = True
+
+    def __init__(self, path: str, page_size: int = 500):
+        self.path = path
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self, create: bool = False) -> Optional[sqlite3.Connection]:
+        """Opens the database on first use. Must be called with the lock held; reads see no file as an empty store."""
+        if self._conn is None:
+            if not create and not os.path.exists(self.path):
+                return None
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SQLITE_SCHEMA)
+        return self._conn
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            db = self._db()
+            return db is None or db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        with self._lock:
+            db = self._db()
+            rows = db.execute(SQL_BLOB_SESSIONS).fetchall() if db is not None else []
+        return {"users": {}, "sessions": {str(uid): data for uid, data in rows}}
+
+    def write(self, records: List[Record]):
+        if not records:
+            return
+        with self._lock:
+            self._db(create=True)
+            self._conn.execute("BEGIN")
+            try:
+                for table, key, raw in records:
+                    if table == "users":
+                        self._write_user(int(key), raw)
+                    elif raw is None:
+                        self._conn.execute(SQL_DELETE_SESSION, (int(key),))
+                    else:
+                        self._conn.execute(SQL_UPSERT_SESSION, (int(key), raw))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _write_user(self, uid: int, raw: Optional[str]):
+        if raw is None:
+            self._conn.execute(SQL_DELETE_USER, (uid,))
+            self._conn.execute(SQL_DELETE_PACKS, (uid,))
+            return
+        user = json.loads(raw)
+        packs = user.pop("packs", None) or []
+        columns = [user.pop(c, None) for c in USER_COLUMNS]
+        self._conn.execute(SQL_UPSERT_USER, (uid, columns[0] or 0, *columns[1:], json.dumps(user)))
+        self._conn.executemany(SQL_UPSERT_PACK, [(uid, p["short_name"], p["name"], i) for i, p in enumerate(packs)])
+        self._conn.execute(SQL_TRIM_PACKS, (uid, len(packs)))
+
+    def fetch(self, table: str, key: str) -> Optional[str]:
+        uid = int(key)
+        with self._lock:
+            db = self._db()
+            if db is None:
+                return None
+            if table == "sessions":
+                row = db.execute(SQL_SELECT_SESSION, (uid,)).fetchone()
+                return row[0] if row else None
+            row = db.execute(SQL_SELECT_USER, (uid,)).fetchone()
+            if row is None:
+                return None
+            packs = db.execute(SQL_SELECT_PACKS, (uid,)).fetchall()
+        user = json.loads(row[4])
+        user.update(zip(USER_COLUMNS, row[:4]))
+        user["packs"] = [{"name": name, "short_name": short_name} for name, short_name in packs]
+        return json.dumps(user)
+
+    def iter_keys(self, table: str, after: Optional[int] = None, skip_blocked: bool = False) -> Iterator[str]:
+        # Keyset pagination: the lock is never held while the caller awaits.
+        last = after if after is not None else -(2 ** 63)
+        if table == "users":
+            sql = SQL_REACHABLE_USER_IDS if skip_blocked else SQL_USER_IDS
+        else:
+            sql = SQL_USER_IDS.replace("users", "sessions")
+        while True:
+            with self._lock:
+                db = self._db()
+                rows = db.execute(sql, (last, self.page_size)).fetchall() if db is not None else []
+            for (uid,) in rows:
+                yield str(uid)
+            if len(rows) < self.page_size:
+                return
+            last = rows[-1][0]
+
+    def current_pack(self, key: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            db = self._db()
+            row = db.execute(SQL_CURRENT_PACK, (int(key),)).fetchone() if db is not None else None
+        return {"name": row[0], "short_name": row[1]} if row else None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.close()
+                self._conn = None
+
+
+def migrate_json_to_sqlite(json_path: str, engine: SqliteEngine) -> int:
+    """
+    One-shot import of the JSON store into SQLite.
+
+    Pending journal deltas are folded into the snapshot first, which is
+    then renamed to ``<json_path>.migrated`` so the import never runs twice.
+    """
+    source = JournalEngine(json_path)
+    tables = source.load()
+    source.compact(wait=True)
+    source.close()
+    records = [(table, key, raw) for table in TABLES for key, raw in tables[table].items()]
+    engine.write(records)
+    os.replace(json_path, f"{json_path}.migrated")
+    if os.path.exists(source.journal_path):
+        os.remove(source.journal_path)
+    logger.info(f"Migrated {len(records)} records from {json_path} to {engine.path}")
+    return len(records)
+
+
+def create_engine(name: str, path: str) -> StorageEngine:
+    if name == "json":
+        return JsonFileEngine(path)
+    if name == "journal":
+        return JournalEngine(path, compact_every=STORAGE_COMPACT_EVERY, fsync=STORAGE_FSYNC)
+    if name == "sqlite":
+        engine = SqliteEngine(os.path.splitext(path)[0] + ".db")
+        if engine.is_empty() and (os.path.exists(path) or os.path.exists(f"{path}.journal")):
+            migrate_json_to_sqlite(path, engine)
+        return engine
+    raise ValueError(f"Unknown storage engine: {name}")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m bot_core.services.storage_engines <bot_storage.json> <bot_storage.db>")
+    migrate_json_to_sqlite(sys.argv[1], SqliteEngine(sys.argv[2]))
@@ -0,0 +1,183 @@
+"""
+Bounded scheduler for ffmpeg jobs.
+
+At most ``max_concurrent`` encoders run at once. Waiting jobs are queued
+per user and dispatched round-robin, so one user sending a burst of GIFs
+cannot starve everyone else. Jobs that run past ``timeout`` are cancelled,
+which kills their ffmpeg process (see video_processing._communicate).
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from ..config import VIDEO_MAX_CONCURRENT, VIDEO_MAX_QUEUED, VIDEO_JOB_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """The scheduler already holds max_queued waiting jobs."""
+
+
+class VideoJobCancelled(Exception):
+    """The job was cancelled through VideoJobScheduler.cancel()."""
+
+
+class _Job:
+    __slots__ = ("uid", "factory", "future", "enqueued_at", "task")
+
+    def __init__(self, uid: int, factory: Callable[[], Awaitable[Any]]):
+        self.uid = uid
+        self.factory = factory
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+
+class VideoJobScheduler:
+    def __init__(self, max_concurrent: int, max_queued: int, timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._queues: Dict[int, Deque[_Job]] = {}
+        self._turns: Deque[int] = deque()  # users with waiting jobs, in round-robin order
+        self._running: Dict[int, list] = {}
+        self._running_count = 0
+        self.metrics = {
+            "submitted": 0, "started": 0, "finished": 0, "completed": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "rejected": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0, "run_seconds_max": 0.0,
+        }
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def position(self, uid: int) -> int:
+        """1-based dispatch position of the user's first waiting job under round-robin, 0 if none."""
+        queue = self._queues.get(uid)
+        return self._position(queue[0]) if queue else 0
+
+    def _position(self, job: _Job) -> int:
+        """1-based dispatch position of a waiting job under round-robin, 0 if it is not waiting."""
+        queue = self._queues.get(job.uid)
+        if not queue or job not in queue:
+            return 0
+        # The job goes out in round `index`: every user dispatches up to `index`
+        # jobs before it, plus one more for users ahead of its owner in turn.
+        index = queue.index(job)
+        ahead = index
+        before = True
+        for other in self._turns:
+            if other == job.uid:
+                before = False
+                continue
+            ahead += min(len(self._queues[other]), index + 1 if before else index)
+        return ahead + 1
+
+    async def submit(self, uid: int, factory: Callable[[], Awaitable[Any]], on_queued: Optional[Callable[[int], Awaitable[None]]] = None) -> Any:
+        """
+        Runs ``factory()`` once a slot is free and returns its result.
+
+        on_queued is awaited with the queue position when the job has to
+        wait. Raises QueueFullError, VideoJobCancelled or asyncio.TimeoutError.
+        """
+        if self._running_count >= self.max_concurrent and self.queued >= self.max_queued:
+            self.metrics["rejected"] += 1
+            raise QueueFullError()
+
+        job = _Job(uid, factory)
+        self.metrics["submitted"] += 1
+        self._queues.setdefault(uid, deque()).append(job)
+        if uid not in self._turns:
+            self._turns.append(uid)
+        self._dispatch()
+
+        if not job.future.done() and job.task is None and on_queued is not None:
+            try:
+                await on_queued(self._position(job))
+            except Exception as e:
+                logger.warning(f"Queue notification failed: {e}")
+        return await job.future
+
+    def _dispatch(self):
+        while self._running_count < self.max_concurrent and self._turns:
+            uid = self._turns.popleft()
+            queue = self._queues[uid]
+            job = queue.popleft()
+            if queue:
+                self._turns.append(uid)
+            else:
+                del self._queues[uid]
+            self._start(job)
+
+    def _start(self, job: _Job):
+        wait = time.monotonic() - job.enqueued_at
+        self.metrics["wait_seconds_total"] += wait
+        self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], wait)
+        self.metrics["started"] += 1
+        self._running_count += 1
+        self._running.setdefault(job.uid, []).append(job)
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+
+    async def _run(self, job: _Job):
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(job.factory(), timeout=self.timeout)
+            self.metrics["completed"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except asyncio.TimeoutError as e:
+            self.metrics["timed_out"] += 1
+            logger.error(f"Video job for {job.uid} exceeded {self.timeout}s and was killed")
+            if not job.future.done():
+                job.future.set_exception(e)
+        except asyncio.CancelledError:
+            self.metrics["cancelled"] += 1
+            if not job.future.done():
+                job.future.set_exception(VideoJobCancelled())
+        except Exception as e:
+            self.metrics["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            elapsed = time.monotonic() - started
+            self.metrics["finished"] += 1
+            self.metrics["run_seconds_total"] += elapsed
+            self.metrics["run_seconds_max"] = max(self.metrics["run_seconds_max"], elapsed)
+            self._running_count -= 1
+            running = self._running.get(job.uid, [])
+            if job in running:
+                running.remove(job)
+            if not running:
+                self._running.pop(job.uid, None)
+            self._dispatch()
+
+    def cancel(self, uid: int) -> int:
+        """Cancels every waiting and running job of a user; returns how many were affected."""
+        count = 0
+        for job in self._queues.pop(uid, ()):
+            job.future.set_exception(VideoJobCancelled())
+            self.metrics["cancelled"] += 1
+            count += 1
+        if uid in self._turns:
+            self._turns.remove(uid)
+        for job in list(self._running.get(uid, ())):
+            job.task.cancel()
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        m = self.metrics
+        return {
+            **m,
+            "running": self._running_count,
+            "queued": self.queued,
+            "wait_seconds_avg": m["wait_seconds_total"] / max(1, m["started"]),
+            "run_seconds_avg": m["run_seconds_total"] / max(1, m["finished"]),
+        }
+
+
+video_scheduler = VideoJobScheduler(VIDEO_MAX_CONCURRENT, VIDEO_MAX_QUEUED, VIDEO_JOB_TIMEOUT)
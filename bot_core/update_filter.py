@@ -0,0 +1,41 @@
+"""
+Pre-dispatch check on the raw webhook body.
+
+Building the pydantic Update and running it through the routers costs far
+more than reading a couple of keys from the decoded JSON. Updates no
+handler would act on (edited messages, chat member changes, unknown
+callback data, ...) are acknowledged without ever reaching aiogram.
+
+Keep HANDLED_UPDATE_TYPES and CALLBACK_PREFIXES in step with the routers
+in bot_core/handlers.
+"""
+import json
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+HANDLED_UPDATE_TYPES = ("message", "callback_query")
+CALLBACK_PREFIXES = ("menu:", "ai:", "rate:", "admin:", "pack:", "simple:", "check_membership")
+
+stats = {"relevant": 0, "skipped": 0}
+
+
+def loads(body: Union[bytes, str]) -> Dict[str, Any]:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def is_relevant(update: Dict[str, Any]) -> bool:
+    """Whether any handler could act on this raw update."""
+    kind = next((k for k in HANDLED_UPDATE_TYPES if k in update), None)
+    payload = update[kind] if kind is not None else None
+    # Every handler reads from_user.
+    relevant = isinstance(payload, dict) and "from" in payload
+    if relevant and kind == "callback_query":
+        relevant = (payload.get("data") or "").startswith(CALLBACK_PREFIXES)
+    stats["relevant" if relevant else "skipped"] += 1
+    return relevant
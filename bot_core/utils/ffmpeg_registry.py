@@ -0,0 +1,199 @@
+"""
+ffmpeg capability registry.
+
+Discovery (binary lookup, -version, -encoders, ffprobe) runs once, in the
+background where possible, and is persisted to a small JSON file. Later
+cold starts read that file and only stat the binary to confirm it is the
+same one. build.sh writes bin/ffmpeg_caps.json at deploy time, so Vercel
+instances never probe at all.
+
+    python -m bot_core.utils.ffmpeg_registry [cache_file]
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+from ..config import FFMPEG_PATH, FFMPEG_CACHE_FILE
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+# Written by build.sh and shipped with the deployment; read-only at runtime.
+BUILD_CACHE_FILE = os.path.join(PROJECT_ROOT, "bin", "ffmpeg_caps.json")
+# Encoders worth knowing about; the full -encoders list is not kept.
+WANTED_ENCODERS = ("libvpx-vp9", "libvpx", "libwebp", "libx264")
+
+Capabilities = Dict[str, Any]
+
+_caps: Optional[Capabilities] = None
+_discovery: Optional[asyncio.Task] = None
+
+
+def _candidates() -> List[str]:
+    paths = [FFMPEG_PATH] if FFMPEG_PATH else []
+    # Vercel places bin/ in the project root (/var/task).
+    paths += [
+        os.path.join(os.getcwd(), "bin", "ffmpeg"),
+        os.path.join(PROJECT_ROOT, "bin", "ffmpeg"),
+        "/var/task/bin/ffmpeg",
+    ]
+    found = shutil.which("ffmpeg")
+    if found:
+        paths.append(found)
+    paths.append("/usr/bin/ffmpeg")
+    return paths
+
+
+def _find_ffmpeg() -> Optional[str]:
+    for path in _candidates():
+        if os.path.isfile(path):
+            # Force executable permission in case the build script didn't stick
+            if not os.access(path, os.X_OK):
+                logger.info(f"Setting chmod +x on {path}")
+                os.chmod(path, 0o755)
+            return os.path.abspath(path)
+    return None
+
+
+def _find_ffprobe(ffmpeg_path: str) -> Optional[str]:
+    sibling = os.path.join(os.path.dirname(ffmpeg_path), "ffprobe")
+    if os.path.isfile(sibling):
+        if not os.access(sibling, os.X_OK):
+            os.chmod(sibling, 0o755)
+        return sibling
+    return shutil.which("ffprobe")
+
+
+async def _output(*cmd: str) -> str:
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    stdout, _ = await process.communicate()
+    return stdout.decode(errors="replace")
+
+
+async def _probe() -> Capabilities:
+    ffmpeg_path = _find_ffmpeg()
+    if not ffmpeg_path:
+        logger.error("FFmpeg NOT FOUND")
+        return {"ffmpeg": None}
+
+    version, encoders, vp9_help = await asyncio.gather(
+        _output(ffmpeg_path, "-hide_banner", "-version"),
+        _output(ffmpeg_path, "-hide_banner", "-encoders"),
+        _output(ffmpeg_path, "-hide_banner", "-h", "encoder=libvpx-vp9"),
+    )
+    # Encoder lines look like " V....D libvpx-vp9  libvpx VP9 (codec vp9)".
+    names = {parts[1] for parts in map(str.split, encoders.splitlines()) if len(parts) > 1}
+    caps = {
+        "ffmpeg": ffmpeg_path,
+        "ffmpeg_size": os.path.getsize(ffmpeg_path),
+        "version": version.splitlines()[0] if version else "",
+        "encoders": [name for name in WANTED_ENCODERS if name in names],
+        # Multithreaded VP9 rows; only libvpx >= 1.7 builds have it.
+        "vp9_row_mt": "row-mt" in vp9_help,
+        "ffprobe": _find_ffprobe(ffmpeg_path),
+    }
+    logger.info(f"FFmpeg capabilities: {caps}")
+    return caps
+
+
+def _to_disk(caps: Capabilities, cache_dir: str) -> Capabilities:
+    # Binaries next to the cache file are stored relative to it, so a file
+    # written at build time stays valid wherever the deployment is mounted.
+    stored = dict(caps)
+    for key in ("ffmpeg", "ffprobe"):
+        path = stored.get(key)
+        if path and os.path.dirname(path) == cache_dir:
+            stored[key] = os.path.basename(path)
+    return stored
+
+
+def _from_disk(stored: Capabilities, cache_dir: str) -> Capabilities:
+    caps = dict(stored)
+    for key in ("ffmpeg", "ffprobe"):
+        path = caps.get(key)
+        if path and not os.path.isabs(path):
+            caps[key] = os.path.join(cache_dir, path)
+    return caps
+
+
+def _load_cache() -> Optional[Capabilities]:
+    for cache_file in (FFMPEG_CACHE_FILE, BUILD_CACHE_FILE):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                caps = _from_disk(json.load(f), os.path.dirname(os.path.abspath(cache_file)))
+        except (OSError, ValueError):
+            continue
+        path = caps.get("ffmpeg")
+        if FFMPEG_PATH and path != os.path.abspath(FFMPEG_PATH):
+            continue
+        # Same binary still in place? A stat is all a warm cache costs.
+        if path and os.path.isfile(path) and os.path.getsize(path) == caps.get("ffmpeg_size"):
+            if not os.access(path, os.X_OK):
+                os.chmod(path, 0o755)
+            return caps
+    return None
+
+
+def _save_cache(caps: Capabilities, cache_file: str = FFMPEG_CACHE_FILE):
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    try:
+        tmp_path = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_to_disk(caps, cache_dir), f)
+        os.replace(tmp_path, cache_file)
+    except OSError as e:
+        logger.warning(f"Could not write ffmpeg cache {cache_file}: {e}")
+
+
+def known_capabilities() -> Optional[Capabilities]:
+    """Capabilities if already resolved in memory; never probes (safe for health checks)."""
+    return _caps
+
+
+async def _discover() -> Capabilities:
+    global _caps
+    caps = _load_cache()
+    if caps is None:
+        caps = await _probe()
+        if not caps.get("ffmpeg"):
+            # Not remembered: the next caller looks again.
+            return caps
+        _save_cache(caps)
+    _caps = caps
+    return caps
+
+
+async def get_capabilities() -> Capabilities:
+    """Resolved capabilities; concurrent callers share a single discovery."""
+    global _discovery
+    if _caps is not None:
+        return _caps
+    if _discovery is None or _discovery.done():
+        _discovery = asyncio.get_running_loop().create_task(_discover())
+    return await asyncio.shield(_discovery)
+
+
+async def is_ffmpeg_installed() -> bool:
+    return (await get_capabilities()).get("ffmpeg") is not None
+
+
+def start_ffmpeg_discovery():
+    """Resolves capabilities in the background on the running loop."""
+    global _discovery
+    if _caps is None and _discovery is None:
+        _discovery = asyncio.get_running_loop().create_task(_discover())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else FFMPEG_CACHE_FILE
+    result = asyncio.run(_probe())
+    if not result.get("ffmpeg"):
+        sys.exit(1)
+    _save_cache(result, target)
+    print(f"Wrote {target}")
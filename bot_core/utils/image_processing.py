@@ -1,9 +1,13 @@
 import os
+import hashlib
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional
-from PIL import Image, ImageDraw, ImageFont
+from typing import Optional, Tuple
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 import arabic_reshaper
 from bidi.algorithm import get_display
+from ..config import RENDER_CACHE_BYTES, BACKGROUND_CACHE_BYTES, PREVIEW_SIZE
+from .cache import LRUCache
 
 FONT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fonts")
 LOCAL_FONT_FILES = {
@@ -22,73 +26,256 @@ def resolve_font_path(font_key: Optional[str], text: str = "") -> str:
     is_persian = any('\u0600' <= char <= '\u06FF' for char in text)
     return _LOCAL_FONTS.get("Vazirmatn" if is_persian else "Roboto", next(iter(_LOCAL_FONTS.values()), ""))
 
+MIN_FONT_SIZE = 12
+
+@lru_cache(maxsize=1024)
 def _prepare_text(text: str) -> str:
     return get_display(arabic_reshaper.reshape(text))
 
-def render_image(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None, as_webp: bool = False) -> bytes:
-    MAX_DIM = 512
-    W, H = MAX_DIM, MAX_DIM
+@lru_cache(maxsize=256)
+def _load_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, size=size)
+
+def warm_fonts():
+    """Preloads the bundled faces at the preset sizes (used as render worker initializer)."""
+    for font_path in set(_LOCAL_FONTS.values()):
+        for size in (64, 96, 128):
+            _load_font(font_path, size)
+    _prepare_text("warm up")
+
+def _fit_font(draw: ImageDraw.ImageDraw, txt: str, font_path: str, base_size: int, box_w: int, box_h: int, min_size: int = MIN_FONT_SIZE) -> ImageFont.FreeTypeFont:
+    """
+    Returns the largest font (at most base_size) whose text fits the box,
+    or min_size when nothing does.  The first guess scales the size
+    measured at base_size by the overflow ratio and is then verified, with a
+    binary search as fallback, so a render needs a handful of layouts
+    instead of one per size step.
+    """
+    def measure(size: int) -> Tuple[int, int]:
+        bbox = draw.textbbox((0, 0), txt, font=_load_font(font_path, size))
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    def fits(size: int) -> bool:
+        w, h = measure(size)
+        return w <= box_w and h <= box_h
+
+    w, h = measure(base_size)
+    if w <= box_w and h <= box_h:
+        return _load_font(font_path, base_size)
+
+    # Sizes above hi overflow; best is the largest size known to fit,
+    # falling back to min_size like the old step-down loop did.
+    lo, hi, best = min_size + 1, base_size - 1, min_size
+    guess = int(base_size * min(box_w / max(w, 1), box_h / max(h, 1)))
+    if lo <= guess <= hi:
+        if fits(guess):
+            if guess == hi or not fits(guess + 1):
+                return _load_font(font_path, guess)
+            best, lo = guess + 1, guess + 2
+        else:
+            hi = guess - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            best, lo = mid, mid + 1
+        else:
+            hi = mid - 1
+    return _load_font(font_path, best)
+
+RENDER_CACHE = LRUCache(RENDER_CACHE_BYTES)
+# Decoded, thumbnailed and centred photo layers keyed by (size, photo hash).
+# Process workers each hold their own copy; render threads share this one.
+BACKGROUND_CACHE = LRUCache(BACKGROUND_CACHE_BYTES, sizeof=lambda img: img.width * img.height * 4)
+
+def photo_digest(bg_photo: bytes) -> str:
+    return hashlib.blake2b(bg_photo, digest_size=16).hexdigest()
+
+def render_cache_key(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None, as_webp: bool = False, fast: bool = False, preview: bool = False) -> Tuple:
+    """Normalizes render parameters so equivalent calls share one cache entry."""
+    if bg_photo:
+        background = "photo:" + photo_digest(bg_photo)
+    else:
+        background = "default" if bg_mode == "default" else "transparent"
+    size_key = size_key if size_key in ("small", "large") else "medium"
+    output = "preview" if preview else "webp" if as_webp else "png-fast" if fast else "png"
+    return (text, v_pos, h_pos, resolve_font_path(font_key, text), color_hex.upper(), size_key, background, output)
+
+def render_image(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None, as_webp: bool = False, fast: bool = False) -> bytes:
+    key = render_cache_key(text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, bg_photo, as_webp, fast)
+    result = RENDER_CACHE.get(key)
+    if result is None:
+        result = _render_image(text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, bg_photo, as_webp, fast)
+        RENDER_CACHE.put(key, result)
+    return result
 
-    img = Image.new("RGBA", (W, H), (0, 0, 0, 0))
+STICKER_SIZE = 512
+DEFAULT_BG = (20, 20, 35, 255)
+# Telegram shows transparent photos on white; previews are flattened the same way.
+PREVIEW_BG = (255, 255, 255, 255)
 
+def _background_layer(dim: int, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None) -> Image.Image:
+    """Builds the dim x dim RGBA layer the text is drawn on."""
+    img = Image.new("RGBA", (dim, dim), (0, 0, 0, 0))
     if bg_photo:
         try:
-            bg_img = Image.open(BytesIO(bg_photo)).convert("RGBA")
-            bg_img.thumbnail((W, H), Image.Resampling.LANCZOS)
-            paste_x = (W - bg_img.width) // 2
-            paste_y = (H - bg_img.height) // 2
+            bg_img = Image.open(BytesIO(bg_photo))
+            bg_img.draft("RGB", (dim, dim))  # JPEG: decode at a reduced scale straight away
+            bg_img = bg_img.convert("RGBA")
+            bg_img.thumbnail((dim, dim), Image.Resampling.LANCZOS)
+            paste_x = (dim - bg_img.width) // 2
+            paste_y = (dim - bg_img.height) // 2
             img.paste(bg_img, (paste_x, paste_y), bg_img)
         except Exception as e:
             print(f"Error processing background photo, falling back to transparent: {e}")
-            pass
     elif bg_mode == "default":
-        img = Image.new("RGBA", (W, H), (20, 20, 35, 255))
+        img = Image.new("RGBA", (dim, dim), DEFAULT_BG)
+    return img
+
+@lru_cache(maxsize=8)
+def _plain_background(dim: int, bg_mode: str) -> Image.Image:
+    """Cached photo-less background ("preview" is the white preview canvas); callers must copy before drawing."""
+    if bg_mode == "preview":
+        return Image.new("RGBA", (dim, dim), PREVIEW_BG)
+    return _background_layer(dim, bg_mode)
+
+def _photo_background(dim: int, bg_photo: bytes) -> Image.Image:
+    """Photo background layer, decoded once per photo and size; callers must copy before drawing."""
+    key = (dim, photo_digest(bg_photo))
+    layer = BACKGROUND_CACHE.get(key)
+    if layer is None:
+        layer = _background_layer(dim, bg_photo=bg_photo)
+        BACKGROUND_CACHE.put(key, layer)
+    return layer
 
+def _draw_text(img: Image.Image, text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str):
+    """Draws the sticker text onto img, scaling the 512px layout to img's size."""
+    W, H = img.size
+    scale = W / STICKER_SIZE
     draw = ImageDraw.Draw(img)
     color = tuple(int(color_hex.lstrip('#')[i:i+2], 16) for i in (0, 2, 4)) + (255,)
-    padding = 40
+    padding = round(40 * scale)
     box_w, box_h = W - 2*padding, H - 2*padding
-    base_size = {"small": 64, "medium": 96, "large": 128}.get(size_key, 96)
+    base_size = round({"small": 64, "medium": 96, "large": 128}.get(size_key, 96) * scale)
     font_path = resolve_font_path(font_key, text)
     txt = _prepare_text(text)
 
-    size = base_size
-    while size > 12:
-        try:
-            font = ImageFont.truetype(font_path, size=size)
-            bbox = draw.textbbox((0,0), txt, font=font)
-            if (bbox[2]-bbox[0] <= box_w) and (bbox[3]-bbox[1] <= box_h):
-                break
-        except Exception:
-            break
-        size -= 1
-
-    font = ImageFont.truetype(font_path, size=size)
+    font = _fit_font(draw, txt, font_path, base_size, box_w, box_h, min_size=max(6, round(MIN_FONT_SIZE * scale)))
     bbox = draw.textbbox((0,0), txt, font=font)
     text_width, text_height = bbox[2]-bbox[0], bbox[3]-bbox[1]
 
     y = {"top": padding, "bottom": H - padding - text_height}.get(v_pos, (H - text_height) / 2)
     x = {"left": padding, "right": W - padding - text_width}.get(h_pos, W / 2)
     anchor = "mm" if h_pos == "center" else "lm"
-    draw.text((x, y), txt, font=font, fill=color, anchor=anchor, stroke_width=2, stroke_fill=(0,0,0,220))
+    draw.text((x, y), txt, font=font, fill=color, anchor=anchor, stroke_width=max(1, round(2 * scale)), stroke_fill=(0,0,0,220))
+
+def _render_image(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None, as_webp: bool = False, fast: bool = False) -> bytes:
+    if bg_photo:
+        img = _photo_background(STICKER_SIZE, bg_photo).copy()
+    else:
+        img = _plain_background(STICKER_SIZE, bg_mode).copy()
+    _draw_text(img, text, v_pos, h_pos, font_key, color_hex, size_key)
 
-    buf = BytesIO()
     if as_webp:
+        buf = BytesIO()
         img.save(buf, format="WEBP", quality=90)
+        return buf.getvalue()
+    return encode_png(img, fast=fast)
+
+def _render_overlay(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str) -> Tuple[bytes, int, int]:
+    """
+    Video text overlay cropped to the drawn text: the PNG of the opaque
+    region plus its (x, y) offset on the 512 canvas, so ffmpeg only blends
+    that region into each frame. Empty bytes when nothing was drawn.
+    """
+    img = _plain_background(STICKER_SIZE, "transparent").copy()
+    _draw_text(img, text, v_pos, h_pos, font_key, color_hex, size_key)
+    bbox = img.getchannel("A").getbbox()
+    if bbox is None:
+        return b"", 0, 0
+    return encode_png(img.crop(bbox), fast=True), bbox[0], bbox[1]
+
+def _render_preview(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None) -> bytes:
+    """
+    Low-cost JPEG preview at PREVIEW_SIZE: the text is laid out directly
+    at preview scale on top of a cached background layer, so nothing is
+    rendered at full size and no PNG encoder runs.
+    """
+    if bg_photo:
+        img = _plain_background(PREVIEW_SIZE, "preview").copy()
+        img.alpha_composite(_photo_background(PREVIEW_SIZE, bg_photo))
+    else:
+        img = _plain_background(PREVIEW_SIZE, "default" if bg_mode == "default" else "preview").copy()
+    _draw_text(img, text, v_pos, h_pos, font_key, color_hex, size_key)
+    buf = BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+def render_preview(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None) -> bytes:
+    key = render_cache_key(text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, bg_photo, preview=True)
+    result = RENDER_CACHE.get(key)
+    if result is None:
+        result = _render_preview(text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, bg_photo)
+        RENDER_CACHE.put(key, result)
+    return result
+
+PNG_SIZE_TARGET = 64 * 1024
+
+def predict_png_size(img: Image.Image) -> int:
+    """
+    Rough size of a full-colour PNG of img, without encoding it.
+
+    PNG's Sub filter leaves roughly the horizontal pixel deltas for deflate,
+    so their entropy over the non-transparent area approximates the
+    compressed size. Transparent areas compress to almost nothing, which
+    settles text-only stickers from the alpha histogram alone; the entropy
+    is measured on a half-size copy to keep the estimate cheap.
+    """
+    pixels = img.width * img.height
+    coverage = 1 - img.getchannel("A").histogram()[0] / pixels
+    upper_bound = int(coverage * pixels * 4 * 1.5)
+    if upper_bound <= PNG_SIZE_TARGET:
+        return upper_bound
+    rgb = img.reduce(2).convert("RGB")
+    delta = ImageChops.difference(rgb, ImageChops.offset(rgb, 1, 0)).convert("L")
+    return int(delta.entropy() / 8 * upper_bound)
+
+def _save_png(img: Image.Image, fast: bool = False) -> bytes:
+    buf = BytesIO()
+    if fast:
+        img.save(buf, format="PNG", compress_level=1)
     else:
         img.save(buf, format="PNG", optimize=True, compress_level=9)
+    return buf.getvalue()
+
+def _quantize(img: Image.Image) -> Image.Image:
+    return img.quantize(colors=256, dither=Image.Dither.NONE).convert("RGBA")
 
-    result = buf.getvalue()
+def encode_png(img: Image.Image, fast: bool = False) -> bytes:
+    """
+    Encodes a sticker as PNG in a single pass where possible.
 
-    if not as_webp and len(result) > 64 * 1024:
+    fast: for images that never go into a pack (video overlays); trades
+    size for speed.
+    Otherwise images with at most 256 colours are encoded as they are, and
+    richer ones (photo backgrounds) are quantized up front when the
+    predicted full-colour size exceeds PNG_SIZE_TARGET. A full-colour result
+    that still ends up over the target gets the old quantize fallback.
+    """
+    if fast:
+        return _save_png(img, fast=True)
+
+    if img.getcolors(256) is None and predict_png_size(img) > PNG_SIZE_TARGET:
         try:
-            quantized_img = img.quantize(colors=256, dither=Image.Dither.NONE).convert("RGBA")
-            buf2 = BytesIO()
-            quantized_img.save(buf2, format="PNG", optimize=True, compress_level=9)
-            new_result = buf2.getvalue()
+            return _save_png(_quantize(img))
+        except Exception as e:
+            print(f"Could not quantize image: {e}")
+
+    result = _save_png(img)
+    if len(result) > PNG_SIZE_TARGET:
+        try:
+            new_result = _save_png(_quantize(img))
             if len(new_result) < len(result):
                 result = new_result
         except Exception as e:
             print(f"Could not quantize image: {e}")
-
     return result
@@ -0,0 +1,134 @@
+"""
+Async front end for render_image.
+
+Cache hits are answered on the event loop; misses run _render_image in a
+worker pool so LANCZOS resizing, stroked text and PNG encoding never stall
+other updates.  At most RENDER_MAX_PENDING renders are in flight; further
+callers wait for a slot instead of piling work onto the pool.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+from ..config import RENDER_EXECUTOR, RENDER_WORKERS, RENDER_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[Executor] = None
+# Set once a process pool breaks: by then other threads are running and
+# forking again could deadlock the children, so renders move to threads.
+_process_pool_broken = False
+_slots: Optional[asyncio.Semaphore] = None
+_stats = {"submitted": 0, "waiting": 0, "in_flight": 0}
+
+
+def _ip():
+    # Pillow, arabic_reshaper and bidi load with the first render, not with the handlers.
+    from . import image_processing
+    return image_processing
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if RENDER_EXECUTOR == "process" and not _process_pool_broken:
+            # fork, not spawn: spawn re-imports __main__ in every worker, which would
+            # open a second Storage on the same journal. With fork the pool creates
+            # all workers on first submit, so start_render_service() must run before
+            # any other threads exist.
+            _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("fork"), initializer=_ip().warm_fonts)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render", initializer=_ip().warm_fonts)
+        logger.info(f"Render pool started: {'thread' if isinstance(_executor, ThreadPoolExecutor) else 'process'} x{RENDER_WORKERS}")
+    return _executor
+
+
+def start_render_service():
+    """Starts the pool ahead of the first render so workers are warm. Call before starting other threads."""
+    executor = _get_executor()
+    if isinstance(executor, ProcessPoolExecutor):
+        # Any submit forks every worker now; each warms its fonts in the initializer.
+        executor.submit(int)
+
+
+def shutdown_render_service():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _replace_broken(executor: Executor):
+    """Drops a pool whose worker died (OOM, crash in Pillow); the next submit starts a thread pool."""
+    global _executor, _process_pool_broken
+    if _executor is executor:
+        logger.error("Render pool broke, falling back to threads")
+        _process_pool_broken = True
+        executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def render_stats() -> Dict[str, int]:
+    return dict(_stats)
+
+
+async def _run_in_pool(func, *args):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(RENDER_MAX_PENDING)
+
+    _stats["waiting"] += 1
+    async with _slots:
+        _stats["waiting"] -= 1
+        _stats["in_flight"] += 1
+        _stats["submitted"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                executor = _get_executor()
+                try:
+                    return await loop.run_in_executor(executor, func, *args)
+                except BrokenProcessPool:
+                    _replace_broken(executor)
+                    if attempt:
+                        raise
+        finally:
+            _stats["in_flight"] -= 1
+
+
+async def _render_cached(key, func, *args) -> bytes:
+    cache = _ip().RENDER_CACHE
+    result = cache.get(key)
+    if result is not None:
+        return result
+    result = await _run_in_pool(func, *args)
+    cache.put(key, result)
+    return result
+
+
+def _picklable(bg_photo: Optional[bytes]) -> Optional[bytes]:
+    # mmap-backed views cannot cross a process boundary
+    if bg_photo is not None and not isinstance(bg_photo, bytes):
+        return bytes(bg_photo)
+    return bg_photo
+
+
+async def render_image_async(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None, as_webp: bool = False, fast: bool = False) -> bytes:
+    ip = _ip()
+    key = ip.render_cache_key(text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, bg_photo, as_webp, fast)
+    return await _render_cached(key, ip._render_image, text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, _picklable(bg_photo), as_webp, fast)
+
+
+async def render_preview_async(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str, bg_mode: str = "transparent", bg_photo: Optional[bytes] = None) -> bytes:
+    """Small JPEG preview for the editing steps; never use it for pack uploads."""
+    ip = _ip()
+    key = ip.render_cache_key(text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, bg_photo, preview=True)
+    return await _render_cached(key, ip._render_preview, text, v_pos, h_pos, font_key, color_hex, size_key, bg_mode, _picklable(bg_photo))
+
+
+async def render_overlay_async(text: str, v_pos: str, h_pos: str, font_key: str, color_hex: str, size_key: str) -> Tuple[bytes, int, int]:
+    """Cropped video overlay and its offset; video_processing caches these on disk, not in RENDER_CACHE."""
+    return await _run_in_pool(_ip()._render_overlay, text, v_pos, h_pos, font_key, color_hex, size_key)
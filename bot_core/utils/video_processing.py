@@ -1,147 +1,316 @@
 import os
 import subprocess
 import asyncio
+import tempfile
 import traceback
 import logging
+import struct
 import sys
-from typing import Optional, Dict, Any
-from .image_processing import render_image
+import json
+import glob
+import hashlib
+from typing import Optional, Dict, Any, Tuple, Union
+from ..config import VIDEO_WORKDIR, VIDEO_ENCODE_ATTEMPTS, VIDEO_CPU_USED, VIDEO_OVERLAY_CACHE_FILES
+from .image_processing import render_cache_key
+from .render_service import render_overlay_async
+from .ffmpeg_registry import get_capabilities
 
-logger = logging.getLogger(__name__)
+from ..services.blob_store import BytesLike
 
-# Cache FFmpeg path
-FFMPEG_PATH_CACHE = None
+logger = logging.getLogger(__name__)
 
 async def get_ffmpeg_path() -> Optional[str]:
-    global FFMPEG_PATH_CACHE
-    if FFMPEG_PATH_CACHE is not None:
-        return FFMPEG_PATH_CACHE
+    return (await get_capabilities()).get("ffmpeg")
 
-    # 1. Direct path in Vercel root
-    # Vercel places bin/ in the project root
-    root_bin = os.path.join(os.getcwd(), "bin", "ffmpeg")
+async def _communicate(process: asyncio.subprocess.Process, input: Optional[BytesLike] = None):
+    """process.communicate() that kills ffmpeg when the awaiting task is cancelled (e.g. a scheduler timeout)."""
+    try:
+        return await process.communicate(input=input)
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
 
-    # 2. Path relative to this file
-    # bot_core/utils/video_processing.py -> ../../bin/ffmpeg
-    this_dir = os.path.dirname(os.path.abspath(__file__))
-    rel_bin = os.path.abspath(os.path.join(this_dir, "..", "..", "bin", "ffmpeg"))
+def _workspace_root() -> str:
+    """Prefers a RAM-backed tmpfs so intermediate files never hit the disk."""
+    for candidate in (VIDEO_WORKDIR, "/dev/shm"):
+        if candidate and os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    return tempfile.gettempdir()
 
-    potential_paths = [root_bin, rel_bin, "/var/task/bin/ffmpeg", "/usr/bin/ffmpeg", "ffmpeg"]
+OVERLAY_CACHE_STATS = {"hits": 0, "misses": 0}
 
-    logger.info(f"Checking FFmpeg paths: {potential_paths}")
+def _overlay_cache_dir() -> str:
+    path = os.path.join(_workspace_root(), "sticker_overlay_cache")
+    os.makedirs(path, exist_ok=True)
+    return path
 
-    for path in potential_paths:
+def _evict_overlays(cache_dir: str):
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".png")]
+    if len(entries) <= VIDEO_OVERLAY_CACHE_FILES:
+        return
+    entries.sort(key=lambda p: os.stat(p).st_mtime)
+    for path in entries[:len(entries) - VIDEO_OVERLAY_CACHE_FILES]:
         try:
-            if path == "ffmpeg":
-                process = await asyncio.create_subprocess_exec(
-                    "which", "ffmpeg",
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                stdout, _ = await process.communicate()
-                if process.returncode == 0:
-                    found = stdout.decode().strip()
-                    logger.info(f"FFmpeg found in PATH: {found}")
-                    FFMPEG_PATH_CACHE = found
-                    return found
-            elif os.path.exists(path):
-                # Force executable permission in case build script didn't stick
-                if not os.access(path, os.X_OK):
-                    logger.info(f"Setting chmod +x on {path}")
-                    os.chmod(path, 0o755)
-                logger.info(f"FFmpeg found at: {path}")
-                FFMPEG_PATH_CACHE = path
-                return path
-        except Exception as e:
-            logger.error(f"Error checking {path}: {e}")
+            os.remove(path)
+        except OSError:
+            pass
+
+async def get_overlay(text_overlay_data: Dict[str, Any]) -> Optional[Tuple[str, int, int]]:
+    """
+    Path and (x, y) offset of the cropped text overlay for these parameters.
+    Overlays are files named <params digest>_<x>_<y>.png in a cache directory
+    shared by all jobs, so retries and re-rates skip rendering and writing.
+    """
+    params = [text_overlay_data[k] for k in ("text", "v_pos", "h_pos", "font_key", "color_hex", "size_key")]
+    key = render_cache_key(*params, fast=True)
+    digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).hexdigest()
+    cache_dir = _overlay_cache_dir()
+
+    for path in glob.glob(os.path.join(cache_dir, f"{digest}_*.png")):
+        try:
+            _, x, y = os.path.basename(path)[:-4].split("_")
+            os.utime(path)
+        except (ValueError, OSError):
+            continue
+        OVERLAY_CACHE_STATS["hits"] += 1
+        return path, int(x), int(y)
+
+    OVERLAY_CACHE_STATS["misses"] += 1
+    png, x, y = await render_overlay_async(*params)
+    if not png:
+        return None
+    path = os.path.join(cache_dir, f"{digest}_{x}_{y}.png")
+    # Renamed into place, so a concurrent job never reads a half-written file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(png)
+    os.replace(tmp_path, path)
+    _evict_overlays(cache_dir)
+    return path, x, y
+
+def _can_stream(data: BytesLike) -> bool:
+    """
+    Whether ffmpeg can demux the input from a non-seekable pipe.
 
-    # Last resort: search
+    GIF and Matroska/WebM read front to back. MP4/MOV only does when the
+    moov atom precedes mdat ("faststart"); phone recordings usually put it
+    at the end, so those go through a workspace file instead.
+    """
+    head = bytes(data[:16])
+    if head[:6] in (b"GIF87a", b"GIF89a") or head[:4] == b"\x1a\x45\xdf\xa3":
+        return True
+    if head[4:8] != b"ftyp":
+        return False
+    offset, total = 0, len(data)
+    while offset + 8 <= total:
+        size, kind = struct.unpack(">I4s", bytes(data[offset:offset + 8]))
+        if kind == b"moov":
+            return True
+        if kind == b"mdat":
+            return False
+        if size == 1 and offset + 16 <= total:
+            size = struct.unpack(">Q", bytes(data[offset + 8:offset + 16]))[0]
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+# Telegram video sticker limits.
+STICKER_MAX_BYTES = 256 * 1024
+STICKER_MAX_SECONDS = 3.0
+STICKER_MAX_FPS = 30
+STICKER_FPS_STEPS = (30, 24, 20, 15)
+# Share of the size limit given to the video bitrate; the rest covers the
+# WebM container and libvpx overshoot.
+BITRATE_HEADROOM = 0.85
+# Bits per pixel per frame below which a clip of average complexity starts to
+# smear, and the source bits per pixel treated as average complexity.
+MIN_BITS_PER_PIXEL = 0.06
+REFERENCE_SOURCE_BPP = 0.1
+
+# Attempts needed per conversion, keyed by attempt count ("failed" when none fit).
+ENCODE_STATS: Dict[Any, int] = {}
+
+async def get_ffprobe_path() -> Optional[str]:
+    """ffprobe ships next to ffmpeg in bin/ (see build.sh); resolved by the capability registry."""
+    return (await get_capabilities()).get("ffprobe")
+
+def _fraction(value: Optional[str]) -> Optional[float]:
     try:
-        logger.info("Searching for ffmpeg binary...")
-        find_proc = await asyncio.create_subprocess_exec(
-            "find", ".", "-name", "ffmpeg", "-type", "f",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        num, _, den = (value or "").partition("/")
+        result = float(num) / float(den or 1)
+        return result if result > 0 else None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+async def probe_video(input_arg: str, stdin_data: Optional[BytesLike], data_size: int) -> Dict[str, Any]:
+    """
+    Duration, frame geometry, frame rate and source bitrate of the first
+    video stream. Missing values are None; a failed probe returns an empty
+    dict and the encoder plans for the worst case.
+    """
+    ffprobe_path = await get_ffprobe_path()
+    if not ffprobe_path:
+        return {}
+    cmd = [
+        ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration:format=duration,bit_rate',
+        '-of', 'json', input_arg
+    ]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
         )
-        stdout, _ = await find_proc.communicate()
-        if find_proc.returncode == 0:
-            found_paths = stdout.decode().splitlines()
-            if found_paths:
-                found = os.path.abspath(found_paths[0])
-                logger.info(f"FFmpeg found via find: {found}")
-                os.chmod(found, 0o755)
-                FFMPEG_PATH_CACHE = found
-                return found
-    except Exception:
-        pass
-
-    logger.error("FFmpeg NOT FOUND")
-    return None
-
-async def is_ffmpeg_installed() -> bool:
-    return await get_ffmpeg_path() is not None
-
-async def process_video_to_webm(video_bytes: bytes, text_overlay_data: Optional[Dict[str, Any]]) -> Optional[bytes]:
+        stdout, stderr = await _communicate(process, stdin_data)
+        if process.returncode != 0:
+            logger.warning(f"ffprobe failed: {stderr.decode(errors='replace')[-300:]}")
+            return {}
+        probed = json.loads(stdout or b"{}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"ffprobe error: {e}")
+        return {}
+
+    stream = (probed.get("streams") or [{}])[0]
+    fmt = probed.get("format") or {}
+    fps = _fraction(stream.get("avg_frame_rate")) or _fraction(stream.get("r_frame_rate"))
+    duration = _fraction(stream.get("duration")) or _fraction(fmt.get("duration"))
+    if duration is None and fps and str(stream.get("nb_frames", "")).isdigit():
+        duration = int(stream["nb_frames"]) / fps
+    bit_rate = _fraction(fmt.get("bit_rate"))
+    if bit_rate is None and duration:
+        bit_rate = data_size * 8 / duration
+    return {
+        "codec": stream.get("codec_name"),
+        "width": stream.get("width"),
+        "height": stream.get("height"),
+        "fps": fps,
+        "duration": duration,
+        "bit_rate": bit_rate,
+    }
+
+def plan_encode(info: Dict[str, Any], max_bytes: int = STICKER_MAX_BYTES) -> Dict[str, Any]:
+    """
+    Picks duration, frame rate and target bitrate so that a two-pass encode
+    lands under max_bytes. Busy sources (high bits per pixel) get fewer frames
+    so each remaining frame keeps enough bits.
+    """
+    duration = min(info.get("duration") or STICKER_MAX_SECONDS, STICKER_MAX_SECONDS)
+    bitrate = int(max_bytes * 8 * BITRATE_HEADROOM / duration)
+    source_fps = round(min(info.get("fps") or STICKER_MAX_FPS, STICKER_MAX_FPS), 3)
+
+    complexity = 1.0
+    width, height, bit_rate = info.get("width"), info.get("height"), info.get("bit_rate")
+    # GIF bitrates say more about the format than about the motion.
+    if width and height and bit_rate and info.get("codec") != "gif":
+        source_bpp = bit_rate / (width * height * source_fps)
+        complexity = min(max(source_bpp / REFERENCE_SOURCE_BPP, 0.5), 2.0)
+
+    fps = source_fps
+    for step in STICKER_FPS_STEPS:
+        fps = min(step, source_fps)
+        if bitrate / (512 * 512 * fps) >= MIN_BITS_PER_PIXEL * complexity:
+            break
+    return {"duration": round(duration, 3), "fps": fps, "bitrate": bitrate}
+
+def _lower_fps(fps: float) -> float:
+    for step in STICKER_FPS_STEPS:
+        if step < fps:
+            return step
+    return fps
+
+def _record_attempts(key: Any):
+    ENCODE_STATS[key] = ENCODE_STATS.get(key, 0) + 1
+
+async def _run_encoder(cmd: list, stdin_data: Optional[BytesLike]) -> bool:
+    logger.info(f"Running FFmpeg: {' '.join(cmd)}")
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = await _communicate(process, stdin_data)
+    if process.returncode != 0:
+        logger.error(f"FFmpeg return code: {process.returncode}")
+        logger.error(f"FFmpeg stderr: {stderr.decode()}")
+        return False
+    return True
+
+async def process_video_to_webm(video: Union[BytesLike, str], text_overlay_data: Optional[Dict[str, Any]]) -> Optional[bytes]:
+    """Converts a video, given as bytes or as a path to a file, into sticker WebM bytes."""
     ffmpeg_path = await get_ffmpeg_path()
     if not ffmpeg_path:
         return None
 
-    temp_dir = "/tmp"
-    pid = os.getpid()
-    input_path = os.path.join(temp_dir, f"input_{pid}.mp4")
-    overlay_path = os.path.join(temp_dir, f"overlay_{pid}.png")
-    output_path = os.path.join(temp_dir, f"output_{pid}.webm")
+    # Every job gets its own directory, so concurrent conversions never share file names.
+    with tempfile.TemporaryDirectory(prefix="sticker_", dir=_workspace_root()) as workspace:
+        output_path = os.path.join(workspace, "output.webm")
+        passlog = os.path.join(workspace, "pass")
+        try:
+            stdin_data = None
+            if isinstance(video, str):
+                # Already on disk (a downloaded blob): ffmpeg reads it in place.
+                input_arg = video
+                input_size = os.path.getsize(video)
+            elif _can_stream(video):
+                input_arg = "pipe:0"
+                stdin_data = video
+                input_size = len(video)
+            else:
+                input_arg = os.path.join(workspace, "input")
+                with open(input_arg, "wb") as f:
+                    f.write(video)
+                input_size = len(video)
 
-    try:
-        with open(input_path, "wb") as f:
-            f.write(video_bytes)
-
-        if text_overlay_data and text_overlay_data.get("text"):
-            overlay_bytes = render_image(
-                text=text_overlay_data["text"],
-                v_pos=text_overlay_data["v_pos"],
-                h_pos=text_overlay_data["h_pos"],
-                font_key=text_overlay_data["font_key"],
-                color_hex=text_overlay_data["color_hex"],
-                size_key=text_overlay_data["size_key"],
-                bg_mode="transparent"
-            )
-            with open(overlay_path, "wb") as f:
-                f.write(overlay_bytes)
-
-            filter_str = "[0:v]scale='if(gt(iw,ih),512,-1)':'if(gt(ih,iw),512,-1)',pad=512:512:(512-iw)/2:(512-ih)/2:color=black@0[bg];[bg][1:v]overlay=0:0"
-            ffmpeg_cmd = [
-                ffmpeg_path, '-i', input_path, '-i', overlay_path,
-                '-filter_complex', filter_str,
-                '-t', '3', '-an', '-c:v', 'libvpx-vp9', '-b:v', '512k', '-crf', '35', '-fs', '250k', '-y', output_path
-            ]
-        else:
-            filter_str = "scale='if(gt(iw,ih),512,-1)':'if(gt(ih,iw),512,-1)',pad=512:512:(512-iw)/2:(512-ih)/2:color=black@0"
-            ffmpeg_cmd = [
-                ffmpeg_path, '-i', input_path,
-                '-vf', filter_str,
-                '-t', '3', '-an', '-c:v', 'libvpx-vp9', '-b:v', '512k', '-crf', '35', '-fs', '250k', '-y', output_path
-            ]
-
-        logger.info(f"Running FFmpeg: {' '.join(ffmpeg_cmd)}")
-        process = await asyncio.create_subprocess_exec(*ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = await process.communicate()
+            plan = plan_encode(await probe_video(input_arg, stdin_data, input_size))
 
-        if process.returncode != 0:
-            logger.error(f"FFmpeg return code: {process.returncode}")
-            logger.error(f"FFmpeg stderr: {stderr.decode()}")
-            return None
+            scale = "scale='if(gt(iw,ih),512,-1)':'if(gt(ih,iw),512,-1)',pad=512:512:(512-iw)/2:(512-ih)/2:color=black@0"
+            inputs = ['-i', input_arg]
+            overlay = None
+            if text_overlay_data and text_overlay_data.get("text"):
+                overlay = await get_overlay(text_overlay_data)
+            if overlay:
+                overlay_path, x, y = overlay
+                inputs += ['-i', overlay_path]
+                filter_base = f"[0:v]{scale}[bg];[bg][1:v]overlay={x}:{y}"
+            else:
+                filter_base = f"[0:v]{scale}"
 
-        if os.path.exists(output_path):
-            with open(output_path, "rb") as f:
-                return f.read()
-        return None
+            row_mt = ['-row-mt', '1'] if (await get_capabilities()).get("vp9_row_mt") else []
+            for attempt in range(1, VIDEO_ENCODE_ATTEMPTS + 1):
+                common = [
+                    ffmpeg_path, '-y', *inputs,
+                    '-filter_complex', f"{filter_base},fps={plan['fps']}",
+                    '-t', str(plan['duration']), '-an',
+                    '-c:v', 'libvpx-vp9', '-b:v', str(plan['bitrate']),
+                    '-deadline', 'good', '-cpu-used', str(VIDEO_CPU_USED),
+                    *row_mt, '-passlogfile', passlog,
+                ]
+                # Two passes let libvpx spend the budget where the motion is instead of guessing.
+                # WebM output stays a file: the muxer seeks back to write duration and cues.
+                if not await _run_encoder(common + ['-pass', '1', '-f', 'null', os.devnull], stdin_data):
+                    break
+                if not await _run_encoder(common + ['-pass', '2', output_path], stdin_data):
+                    break
 
-    except Exception as e:
-        logger.error(f"Processing error: {e}")
-        return None
-    finally:
-        for path in [input_path, overlay_path, output_path]:
-            if os.path.exists(path):
-                try: os.remove(path)
-                except Exception: pass
+                size = os.path.getsize(output_path)
+                if size <= STICKER_MAX_BYTES:
+                    _record_attempts(attempt)
+                    logger.info(f"Encoded {size} bytes in {attempt} attempt(s) with {plan}")
+                    with open(output_path, "rb") as f:
+                        return f.read()
+
+                logger.info(f"Attempt {attempt} produced {size} bytes with {plan}; retrying")
+                plan["bitrate"] = int(plan["bitrate"] * STICKER_MAX_BYTES / size * 0.9)
+                if attempt >= 2:
+                    plan["fps"] = _lower_fps(plan["fps"])
+
+            _record_attempts("failed")
+            return None
+
+        except Exception as e:
+            logger.error(f"Processing error: {e}")
+            return None
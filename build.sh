@@ -21,6 +21,8 @@ if [ -n "$EXTRACTED_DIR" ]; then
     chmod +x bin/ffmpeg bin/ffprobe
     echo "FFmpeg binaries placed in bin/ directory."
     ls -l bin/
+    # Record path, version and encoders now so cold starts skip probing.
+    python3 -m bot_core.utils.ffmpeg_registry bin/ffmpeg_caps.json || echo "WARNING: ffmpeg capability probe failed; it will run at startup."
 else
     echo "ERROR: Failed to find extracted FFmpeg directory."
     exit 1
@@ -7,6 +7,11 @@ from aiogram.enums import ParseMode
 
 from bot_core.config import BOT_TOKEN
 from bot_core.handlers import router
+from bot_core.services.bot_info import load_bot_info
+from bot_core.services.outbound import create_session
+from bot_core.services.storage import storage
+from bot_core.utils.render_service import start_render_service, shutdown_render_service
+from bot_core.utils.ffmpeg_registry import start_ffmpeg_discovery
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,10 +21,14 @@ async def main():
         print("Error: BOT_TOKEN environment variable not set!")
         return
 
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot = Bot(token=BOT_TOKEN, session=create_session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
     dp.include_router(router)
     
+    start_render_service()
+    storage.start_write_behind()
+    start_ffmpeg_discovery()
+    await load_bot_info(bot)
     try:
         print("Bot is starting (polling mode)...")
         await dp.start_polling(bot)
@@ -28,6 +37,9 @@ async def main():
     except Exception as e:
         print(f"Bot error: {e}")
     finally:
+        await storage.stop_write_behind()
+        storage.close()
+        shutdown_render_service()
         await bot.session.close()
 
 if __name__ == "__main__":